@@ -1,52 +1,358 @@
-import curses, requests, threading, math, os, json, random, time
+import curses, requests, threading, asyncio, ssl, base64, math, os, sys, json, random, time, sqlite3, hashlib, zlib, lzma, multiprocessing, argparse, itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit, quote, unquote
 from datetime import datetime
-from queue import Queue
+from queue import Queue, Empty
+from collections import deque
 
 CONFIG_FILENAME="drivecord_config.json"
+API_BASE= os.environ.get("DRIVECORD_API_BASE","https://discord.com/api/v9").rstrip("/")
+DB_FILENAME="drivecord.db"
 CHUNK_SIZE=5*1024*1024
-tasks_queue=Queue()
+UPLOAD_WINDOW_PER_TOKEN=2
+DOWNLOAD_STREAMS_PER_TOKEN=1
+ASYNC_STREAMS_PER_TOKEN=8
+HTTP_POOL_SIZE=10
+HTTP_TIMEOUT=(10,120)
+HTTP_KEEP_ALIVE=True
+RATE_GLOBAL_PER_SEC=50
+RATE_MAX_RETRIES=5
+CHUNK_RETRIES=5
+RETRY_BASE_DELAY=1.0
+RETRY_MAX_DELAY=60.0
+UI_MAX_FPS=10
+COMPRESS_PROBE_SIZE=65536
+COMPRESS_MIN_SAVING=0.1
+COMPRESS_CODECS=("none","zlib","lzma")
+PACK_THRESHOLD_KB=1024
+MESSAGE_SIZE_LIMIT=25*1024*1024
+MAX_ATTACHMENTS=10
+REFS_PER_MESSAGE=12
+PARITY_MAX_PIECES=255
+REBUILD_RANGES_PER_TOKEN=4
+DISCORD_EPOCH_MS=1420070400000
+MANIFEST_SNAPSHOT_EVERY=100
+METRIC_BUCKETS=(0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0)
+METRICS_INTERVAL=10
+PRIO_INTERACTIVE=0
+PRIO_BULK=1
+PRIO_LOW=2
+TASK_RETENTION=300
+CHUNK_QUEUED=1
+CHUNK_SENDING=2
+CHUNK_DONE=3
+CHUNK_FAILED=4
+PRIO_NAMES=("interactive","bulk","low")
+
+class TaskScheduler:
+    def __init__(self):
+        self.cv= threading.Condition()
+        self.groups={}
+        self.rings=[deque() for _ in PRIO_NAMES]
+        self.state={}
+        self.unfinished=0
+        self.watchers=[]
+
+    def wake(self):
+        for cb in self.watchers:cb()
+
+    def put(self,item,group=None,prio=PRIO_BULK):
+        g= item[0] if group is None else group
+        with self.cv:
+            st= self.state.setdefault(g,{"prio":prio,"paused":False,"cancelled":False})
+            q= self.groups.get(g)
+            if q is None:
+                q= self.groups[g]= deque()
+                self.rings[st["prio"]].append(g)
+            q.append(item)
+            self.unfinished+=1
+            self.cv.notify()
+            self.wake()
+
+    def pick(self):
+        for ring in self.rings:
+            for _ in range(len(ring)):
+                g= ring[0]
+                ring.rotate(-1)
+                st= self.state[g]
+                if st["paused"] and not st["cancelled"]:continue
+                q= self.groups[g]
+                item= q.popleft()
+                if not q:
+                    del self.groups[g]
+                    ring.pop()
+                return item
+        return None
+
+    def get(self,timeout=None):
+        end= None if timeout is None else time.time()+timeout
+        with self.cv:
+            while True:
+                item= self.pick()
+                if item is not None:return item
+                if end is None:self.cv.wait()
+                elif end<=time.time() or not self.cv.wait(end-time.time()):
+                    item= self.pick()
+                    if item is None:raise Empty
+                    return item
+
+    def task_done(self):
+        with self.cv:
+            self.unfinished-=1
+            if self.unfinished<=0:self.cv.notify_all()
+
+    def join(self):
+        with self.cv:
+            while self.unfinished>0:self.cv.wait()
+
+    def flag(self,g,key):
+        st= self.state.get(g)
+        return bool(st and st[key])
+
+    def paused(self,g):return self.flag(g,"paused")
+    def cancelled(self,g):return self.flag(g,"cancelled")
+
+    def priority(self,g):
+        st= self.state.get(g)
+        return st["prio"] if st else None
+
+    def pause(self,g,val=True):
+        with self.cv:
+            self.state.setdefault(g,{"prio":PRIO_BULK,"paused":False,"cancelled":False})["paused"]= val
+            self.cv.notify_all()
+            self.wake()
+
+    def cancel(self,g):
+        with self.cv:
+            self.state.setdefault(g,{"prio":PRIO_BULK,"paused":False,"cancelled":False})["cancelled"]= True
+            self.cv.notify_all()
+            self.wake()
+
+    def set_priority(self,g,prio):
+        with self.cv:
+            st= self.state.setdefault(g,{"prio":prio,"paused":False,"cancelled":False})
+            if g in self.groups and st["prio"]!=prio:
+                self.rings[st["prio"]].remove(g)
+                self.rings[prio].append(g)
+            st["prio"]= prio
+            self.cv.notify_all()
+
+    def forget(self,g):
+        with self.cv:
+            if g not in self.groups:self.state.pop(g,None)
+
+tasks_queue=TaskScheduler()
 active_tasks={}
 active_tasks_lock= threading.Lock()
+live_tasks={}
+ended_tasks=deque()
+task_ids= itertools.count(1)
+channel_turn= itertools.count()
+progress_event= threading.Event()
+db_lock= threading.RLock()
+db_conn=None
+file_index={}
+dir_index={}
+dir_paths={}
+tree_cache={}
 worker_threads=[]
+engine=None
 STOP_WORKERS=False
 token_validity_lock= threading.Lock()
 token_validity_map={}
+http_sessions={}
+http_sessions_lock= threading.Lock()
+rate_lock= threading.Lock()
+rate_state={}
+compress_pool=None
+compress_pool_lock= threading.Lock()
+gf_exp=[0]*510
+gf_log=[0]*256
+gf_rows={}
+manifest_wake= threading.Event()
+manifest_thread=None
+metrics={}
+metrics_lock= threading.Lock()
+
+def default_config():
+    return {
+        "server_id":"",
+        "channel_id":"",
+        "bot_tokens":[],
+        "directories":{
+            "name":"root",
+            "files":[],
+            "subdirs":[],
+            "expanded":True
+        },
+        "chunk_size_mb":5,
+        "engine":"threads",
+        "compression":"none",
+        "manifest_channel_id":"",
+        "metrics_file":""
+    }
 
 def load_config():
-    if not os.path.exists(CONFIG_FILENAME):
-        return {
-            "server_id":"",
-            "channel_id":"",
-            "bot_tokens":[],
-            "directories":{
-                "name":"root",
-                "files":[],
-                "subdirs":[],
-                "expanded":True
-            },
-            "chunk_size_mb":5
-        }
-    with open(CONFIG_FILENAME,"r",encoding="utf-8")as f:
-        data=json.load(f)
-    remove_incomplete_uploads(data)
+    open_db()
+    with db_lock:
+        fresh= db_conn.execute("SELECT COUNT(*) FROM settings").fetchone()[0]==0
+    if fresh:
+        data= default_config()
+        if os.path.exists(CONFIG_FILENAME):
+            with open(CONFIG_FILENAME,"r",encoding="utf-8")as f:
+                data.update(json.load(f))
+        import_config(data)
+        if os.path.exists(CONFIG_FILENAME):
+            os.replace(CONFIG_FILENAME,CONFIG_FILENAME+".migrated")
+    data= read_db()
+    remove_stale_uploads(data)
+    index_tree(data)
     return data
 
-def remove_incomplete_uploads(cfg):
+def open_db():
+    global db_conn
+    with db_lock:
+        if db_conn is not None:return
+        db_conn= sqlite3.connect(DB_FILENAME,check_same_thread=False,timeout=30)
+        db_conn.execute("PRAGMA journal_mode=WAL")
+        db_conn.execute("PRAGMA synchronous=NORMAL")
+        with db_conn:
+            db_conn.execute("CREATE TABLE IF NOT EXISTS settings(key TEXT PRIMARY KEY,value TEXT NOT NULL)")
+            db_conn.execute("CREATE TABLE IF NOT EXISTS dirs(path TEXT PRIMARY KEY,expanded INTEGER NOT NULL DEFAULT 0)")
+            db_conn.execute("CREATE TABLE IF NOT EXISTS files(file_id TEXT PRIMARY KEY,dir_path TEXT NOT NULL,record TEXT NOT NULL)")
+            db_conn.execute("CREATE TABLE IF NOT EXISTS chunks(file_id TEXT NOT NULL,idx INTEGER NOT NULL,entry TEXT NOT NULL,PRIMARY KEY(file_id,idx))")
+            db_conn.execute("CREATE TABLE IF NOT EXISTS chunk_index(hash TEXT PRIMARY KEY,entry TEXT NOT NULL)")
+            db_conn.execute("CREATE TABLE IF NOT EXISTS manifest_ops(seq INTEGER PRIMARY KEY AUTOINCREMENT,op TEXT NOT NULL)")
+
+def record_json(rec):
+    r= dict(rec)
+    if "chunks" in r:r["chunks"]=None
+    if "parity_chunks" in r:r["parity_chunks"]=None
+    return json.dumps(r)
+
+def import_config(data):
+    with db_lock,db_conn:
+        for k,v in data.items():
+            if k!="directories":
+                db_conn.execute("INSERT OR REPLACE INTO settings VALUES(?,?)",(k,json.dumps(v)))
+        def dfs(d,path):
+            db_conn.execute("INSERT OR REPLACE INTO dirs VALUES(?,?)",(path,int(d.get("expanded",False))))
+            for f in d["files"]:
+                db_conn.execute("INSERT OR REPLACE INTO files VALUES(?,?,?)",(f["file_id"],path,record_json(f)))
+                for i,ent in enumerate(f.get("chunks") or []):
+                    if ent:db_conn.execute("INSERT OR REPLACE INTO chunks VALUES(?,?,?)",(f["file_id"],i,json.dumps(ent)))
+            for sb in d["subdirs"]:
+                dfs(sb,path+"/"+sb["name"])
+        dfs(data["directories"],"root")
+
+def read_db():
+    cfg= default_config()
+    with db_lock:
+        for k,v in db_conn.execute("SELECT key,value FROM settings"):
+            cfg[k]= json.loads(v)
+        root= cfg["directories"]
+        nodes={"root":root}
+        rows= db_conn.execute("SELECT path,expanded FROM dirs ORDER BY rowid").fetchall()
+        for path,exp in rows:
+            if path=="root":root["expanded"]= bool(exp)
+            else:nodes[path]={"name":path.rpartition("/")[2],"files":[],"subdirs":[],"expanded":bool(exp)}
+        for path,exp in rows:
+            if path!="root":nodes.get(path.rpartition("/")[0],root)["subdirs"].append(nodes[path])
+        recs={}
+        for fid,dp,rec in db_conn.execute("SELECT file_id,dir_path,record FROM files ORDER BY rowid"):
+            r= json.loads(rec)
+            if "chunks" in r:r["chunks"]=[None]*r["chunk_count"]
+            if "parity_chunks" in r:r["parity_chunks"]=[None]*parity_count(r)
+            nodes.get(dp,root)["files"].append(r)
+            recs[fid]= r
+        for fid,idx,ent in db_conn.execute("SELECT file_id,idx,entry FROM chunks"):
+            r= recs.get(fid)
+            if r and r.get("chunks") is not None and idx<len(r["chunks"]):
+                r["chunks"][idx]= json.loads(ent)
+            elif r and r.get("parity_chunks") is not None and idx-r["chunk_count"]<len(r["parity_chunks"]):
+                r["parity_chunks"][idx-r["chunk_count"]]= json.loads(ent)
+    return cfg
+
+def db_put_dir(path,node):
+    with db_lock,db_conn:
+        db_conn.execute("INSERT INTO dirs VALUES(?,?) ON CONFLICT(path) DO UPDATE SET expanded=excluded.expanded",(path,int(node.get("expanded",False))))
+
+def db_put_file(path,rec):
+    with db_lock,db_conn:
+        db_conn.execute("INSERT OR REPLACE INTO files VALUES(?,?,?)",(rec["file_id"],path,record_json(rec)))
+
+def db_update_file(rec):
+    with db_lock,db_conn:
+        db_conn.execute("UPDATE files SET record=? WHERE file_id=?",(record_json(rec),rec["file_id"]))
+
+def db_move_file(fid,path):
+    with db_lock,db_conn:
+        row= db_conn.execute("SELECT record FROM files WHERE file_id=?",(fid,)).fetchone()
+        if not row:return
+        db_conn.execute("DELETE FROM files WHERE file_id=?",(fid,))
+        db_conn.execute("INSERT INTO files VALUES(?,?,?)",(fid,path,row[0]))
+
+def db_put_chunk(fid,idx,ent):
+    t0= time.perf_counter()
+    with db_lock,db_conn:
+        db_conn.execute("INSERT OR REPLACE INTO chunks VALUES(?,?,?)",(fid,idx,json.dumps(ent)))
+    metric_observe("db_chunk_write","-","-",time.perf_counter()-t0)
+
+def db_put_chunks(fid,ents):
+    with db_lock,db_conn:
+        db_conn.executemany("INSERT OR REPLACE INTO chunks VALUES(?,?,?)",[(fid,i,json.dumps(ent)) for i,ent in ents])
+
+def db_get_hash(h):
+    with db_lock:
+        row= db_conn.execute("SELECT entry FROM chunk_index WHERE hash=?",(h,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def db_put_hash(h,ent):
+    with db_lock,db_conn:
+        db_conn.execute("INSERT OR IGNORE INTO chunk_index VALUES(?,?)",(h,json.dumps(ent)))
+
+def db_delete_file(fid):
+    with db_lock,db_conn:
+        db_conn.execute("DELETE FROM chunks WHERE file_id=?",(fid,))
+        db_conn.execute("DELETE FROM files WHERE file_id=?",(fid,))
+
+def db_delete_dir(path):
+    sub= path+"/"
+    with db_lock,db_conn:
+        db_conn.execute("DELETE FROM chunks WHERE file_id IN(SELECT file_id FROM files WHERE dir_path=? OR substr(dir_path,1,?)=?)",(path,len(sub),sub))
+        db_conn.execute("DELETE FROM files WHERE dir_path=? OR substr(dir_path,1,?)=?",(path,len(sub),sub))
+        db_conn.execute("DELETE FROM dirs WHERE path=? OR substr(path,1,?)=?",(path,len(sub),sub))
+
+def source_unchanged(f):
+    sp= f.get("source_path")
+    if not sp or "chunks" not in f or "chunk_size" not in f:return False
+    try:st= os.stat(sp)
+    except OSError:return False
+    return st.st_size==f.get("size") and int(st.st_mtime)==f.get("source_mtime")
+
+def remove_stale_uploads(cfg):
     def dfs(d):
         newfiles=[]
         for f in d["files"]:
-            if f.get("in_process",False):
-                pass
+            if f.get("in_process",False) and not source_unchanged(f):
+                db_delete_file(f["file_id"])
             else:newfiles.append(f)
         d["files"]=newfiles
         for sb in d["subdirs"]:
             dfs(sb)
     dfs(cfg["directories"])
-    save_config(cfg)
 
-def save_config(cfg):
-    with open(CONFIG_FILENAME,"w",encoding="utf-8")as f:
-        json.dump(cfg,f,indent=4)
+def save_config(cfg,keys=None):
+    t0= time.perf_counter()
+    items=[(k,cfg[k]) for k in keys if k in cfg] if keys else list(cfg.items())
+    with db_lock,db_conn:
+        for k,v in items:
+            if k!="directories":
+                db_conn.execute("INSERT OR REPLACE INTO settings VALUES(?,?)",(k,json.dumps(v)))
+    metric_observe("config_save","-","-",time.perf_counter()-t0)
+
+def notify_progress():
+    progress_event.set()
 
 def apply_chunk_size(cfg):
     global CHUNK_SIZE
@@ -65,30 +371,373 @@ def set_chunk_size(cfg,new_val):
     save_config(cfg)
     apply_chunk_size(cfg)
 
+def set_compression(cfg,new_val):
+    sp= new_val.lower().split()
+    codec= sp[0] if sp and sp[0] in COMPRESS_CODECS else"none"
+    try:level= min(9,max(0,int(sp[1])))
+    except:level=6
+    cfg["compression"]= codec
+    cfg["compression_level"]= level
+    save_config(cfg)
+
+def set_parity(cfg,new_val):
+    sp= new_val.split()
+    try:
+        k= max(1,int(sp[0]))
+        m= max(0,int(sp[1])) if len(sp)>1 else 0
+    except:return
+    if k+m>PARITY_MAX_PIECES:return
+    cfg["parity_data"]= k
+    cfg["parity_shards"]= m
+    save_config(cfg)
+
+def storage_channels(cfg):
+    chs=[c for c in cfg.get("channel_ids") or[] if c]
+    return chs or[cfg["channel_id"]]
+
+def set_storage_channels(cfg,new_val):
+    cfg["channel_ids"]=[c for c in new_val.replace(","," ").split() if c.isdigit()]
+    save_config(cfg)
+
+def ent_channel(cfg,ent):
+    return ent.get("channel_id") or cfg["channel_id"]
+
+def compress_chunk(data,codec,level):
+    sample= data[:COMPRESS_PROBE_SIZE]
+    if not sample or len(zlib.compress(sample,1))>len(sample)*(1-COMPRESS_MIN_SAVING):
+        return data,None
+    if codec=="lzma":out= lzma.compress(data,preset=level)
+    else:out= zlib.compress(data,level)
+    if len(out)>=len(data):return data,None
+    return out,codec
+
+def decompress_chunk(data,codec):
+    if codec=="zlib":return zlib.decompress(data)
+    if codec=="lzma":return lzma.decompress(data)
+    return data
+
+def encode_chunk(cfg,data,comp):
+    if not comp:return data,None
+    procs= cfg.get("compression_processes",0)
+    if procs<=0:return compress_chunk(data,comp["codec"],comp["level"])
+    global compress_pool
+    with compress_pool_lock:
+        if compress_pool is None:compress_pool= ProcessPoolExecutor(max_workers=procs)
+    return compress_pool.submit(compress_chunk,bytes(data),comp["codec"],comp["level"]).result()
+
+def gf_init():
+    x=1
+    for i in range(255):
+        gf_exp[i]= gf_exp[i+255]= x
+        gf_log[x]= i
+        x<<=1
+        if x&0x100:x^=0x11d
+
+gf_init()
+
+def gf_mul(a,b):
+    if a==0 or b==0:return 0
+    return gf_exp[gf_log[a]+gf_log[b]]
+
+def gf_inv(a):
+    return gf_exp[255-gf_log[a]]
+
+def gf_scale(c,data):
+    if c==1:return data
+    row= gf_rows.get(c)
+    if row is None:
+        row= gf_rows[c]= bytes(gf_mul(c,x) for x in range(256))
+    return data.translate(row)
+
+def rs_coef(k,j,i):
+    return gf_inv((k+j)^i)
+
+def rs_add(acc,k,i,pd):
+    for j in range(len(acc)):
+        acc[j]^= int.from_bytes(gf_scale(rs_coef(k,j,i),pd),"little")
+
+def rs_row(k,kk,li):
+    if li<kk:return[int(c==li) for c in range(kk)]
+    return[rs_coef(k,li-kk,c) for c in range(kk)]
+
+def rs_invert(mat):
+    n= len(mat)
+    a=[row[:]+[int(c==r) for c in range(n)] for r,row in enumerate(mat)]
+    for c in range(n):
+        p= next(r for r in range(c,n) if a[r][c])
+        a[c],a[p]= a[p],a[c]
+        iv= gf_inv(a[c][c])
+        a[c]=[gf_mul(iv,x) for x in a[c]]
+        for r in range(n):
+            if r!=c and a[r][c]:
+                fct= a[r][c]
+                a[r]=[x^gf_mul(fct,y) for x,y in zip(a[r],a[c])]
+    return[row[n:] for row in a]
+
+def rs_decode(k,kk,pieces,want,ln):
+    lis= sorted(pieces)[:kk]
+    inv= rs_invert([rs_row(k,kk,li) for li in lis])
+    out={}
+    for i in want:
+        acc=0
+        for c,li in zip(inv[i],lis):
+            if c:acc^= int.from_bytes(gf_scale(c,pieces[li]),"little")
+        out[i]= acc.to_bytes(ln,"little")
+    return out
+
+def parity_count(f):
+    par= f.get("parity")
+    if not par:return 0
+    return math.ceil(f["chunk_count"]/par["k"])*par["m"]
+
+def apply_http_settings(cfg):
+    global HTTP_POOL_SIZE,HTTP_TIMEOUT,HTTP_KEEP_ALIVE
+    HTTP_POOL_SIZE= max(1,int(cfg.get("http_pool_size",10)))
+    HTTP_TIMEOUT=(cfg.get("http_connect_timeout",10),cfg.get("http_read_timeout",120))
+    HTTP_KEEP_ALIVE= bool(cfg.get("http_keep_alive",True))
+    with http_sessions_lock:
+        for ss in http_sessions.values():ss.close()
+        http_sessions.clear()
+
+def http_session(tok):
+    with http_sessions_lock:
+        ss= http_sessions.get(tok)
+        if ss is None:
+            ss= requests.Session()
+            ad= requests.adapters.HTTPAdapter(pool_connections=2,pool_maxsize=HTTP_POOL_SIZE)
+            ss.mount("https://",ad)
+            ss.mount("http://",ad)
+            if not HTTP_KEEP_ALIVE:ss.headers["Connection"]="close"
+            http_sessions[tok]= ss
+        return ss
+
+def rate_entry(tok):
+    st= rate_state.get(tok)
+    if st is None:
+        st={"global":0.0,"buckets":{},"second":0.0,"count":0,"inflight":0}
+        rate_state[tok]= st
+    return st
+
+def token_ready_at(tok,route,now):
+    st= rate_entry(tok)
+    t= max(now,st["global"])
+    if route=="cdn":return t
+    if st["count"]>=RATE_GLOBAL_PER_SEC and now-st["second"]<1:
+        t= max(t,st["second"]+1)
+    b= st["buckets"].get(route)
+    if b and b[0]<=0 and b[1]>now:
+        t= max(t,b[1])
+    return t
+
+def take_token(tokens,route):
+    with rate_lock:
+        now= time.time()
+        tok= min(tokens,key=lambda t:(token_ready_at(t,route,now),rate_entry(t)["inflight"]))
+        at= token_ready_at(tok,route,now)
+        if at>now:return None,min(at-now,1.0)
+        st= rate_entry(tok)
+        st["inflight"]+=1
+        if route!="cdn":
+            if now-st["second"]>=1:
+                st["second"]=now
+                st["count"]=0
+            st["count"]+=1
+            b= st["buckets"].get(route)
+            if b and b[1]>now:b[0]-=1
+        return tok,0
+
+def on_loop():
+    eng= engine
+    return eng is not None and threading.current_thread() is eng.thread
+
+def drive(coro):
+    try:coro.send(None)
+    except StopIteration as e:return e.value
+    coro.close()
+    raise RuntimeError("coroutine suspended outside the event loop")
+
+async def nap(secs):
+    if on_loop():await asyncio.sleep(secs)
+    else:time.sleep(secs)
+
+async def offload(fn,*args):
+    if on_loop():return await asyncio.get_running_loop().run_in_executor(None,fn,*args)
+    return fn(*args)
+
+def pick_channel(tokens,channels):
+    n= len(channels)
+    hint= next(channel_turn)
+    with rate_lock:
+        now= time.time()
+        i= min(range(n),key=lambda i:(min(token_ready_at(t,f"POST /channels/{channels[i]}/messages",now) for t in tokens),(i-hint)%n))
+    return channels[i]
+
+def retry_after(r):
+    try:return float(r.json().get("retry_after",1.0))
+    except:pass
+    try:return float(r.headers.get("Retry-After",1.0))
+    except:return 1.0
+
+def note_rate_limit(tok,route,r):
+    now= time.time()
+    h= r.headers
+    with rate_lock:
+        st= rate_entry(tok)
+        if route!="cdn" and "X-RateLimit-Remaining" in h:
+            try:st["buckets"][route]=[int(h["X-RateLimit-Remaining"]),now+float(h.get("X-RateLimit-Reset-After",0))]
+            except ValueError:pass
+        if r.status_code==429:
+            ra= retry_after(r)
+            glob= h.get("X-RateLimit-Global","").lower()=="true"
+            try:glob= glob or bool(r.json().get("global"))
+            except:pass
+            if glob or route=="cdn":st["global"]= max(st["global"],now+ra)
+            else:st["buckets"][route]=[0,now+ra]
+
+def discord_request(tokens,method,url,route,data=None,headers=None):
+    return drive(adiscord_request(tokens,method,url,route,data,headers))
+
+async def adiscord_request(tokens,method,url,route,data=None,headers=None):
+    eng= engine
+    if eng and not on_loop():return eng.call(adiscord_request(tokens,method,url,route,data,headers))
+    if isinstance(tokens,str):tokens=[tokens]
+    op,ch= route_labels(route)
+    for n in range(RATE_MAX_RETRIES+1):
+        while True:
+            tok,wait= take_token(tokens,route)
+            if tok:break
+            await nap(wait)
+        if hasattr(data,"seek"):data.seek(0)
+        hd={"Authorization":f"Bot {tok}",**(headers or{})}
+        t0= time.perf_counter()
+        r=None
+        try:
+            if eng:
+                async with eng.sem(tok):r= await eng.request(method,url,hd,data)
+            else:r= http_session(tok).request(method,url,headers=hd,data=data,timeout=HTTP_TIMEOUT)
+        finally:
+            with rate_lock:rate_entry(tok)["inflight"]-=1
+            metric_observe(op,tok,ch,time.perf_counter()-t0,len(r.content) if r is not None and method=="GET" else 0,r is not None and r.status_code<400)
+        note_rate_limit(tok,route,r)
+        if r.status_code!=429:break
+        metric_count("rate_limited",tok,ch)
+    return r,tok
+
+def route_labels(route):
+    if route=="cdn":return"attachment_get","-"
+    method,_,path= route.partition(" ")
+    sp= path.strip("/").split("/")
+    ch= sp[1] if len(sp)>1 and sp[0]=="channels" else"-"
+    return method+" "+"/".join(x for x in sp if x!=ch),ch
+
+def token_label(tok):
+    return tok.split(".")[0][:8] if tok else"-"
+
+def metric_entry(op,tok,ch):
+    key=(op,token_label(tok),ch)
+    m= metrics.get(key)
+    if m is None:
+        m= metrics[key]={"count":0,"errors":0,"bytes":0,"sum":0.0,"buckets":[0]*(len(METRIC_BUCKETS)+1)}
+    return m
+
+def metric_observe(op,tok,ch,secs,nbytes=0,ok=True):
+    i=0
+    while i<len(METRIC_BUCKETS) and secs>METRIC_BUCKETS[i]:i+=1
+    with metrics_lock:
+        m= metric_entry(op,tok,ch)
+        m["count"]+=1
+        m["sum"]+= secs
+        m["bytes"]+= nbytes
+        m["buckets"][i]+=1
+        if not ok:m["errors"]+=1
+
+def metric_count(op,tok,ch,n=1):
+    with metrics_lock:metric_entry(op,tok,ch)["count"]+= n
+
+def metric_quantile(m,q):
+    if not m["count"] or not any(m["buckets"]):return None
+    need= q*sum(m["buckets"])
+    acc=0
+    for i,c in enumerate(m["buckets"]):
+        acc+= c
+        if acc>=need:return METRIC_BUCKETS[i] if i<len(METRIC_BUCKETS) else float("inf")
+    return None
+
+def metrics_snapshot():
+    with metrics_lock:
+        return{k:{**v,"buckets":v["buckets"][:]} for k,v in metrics.items()}
+
+def metrics_json(snap):
+    return json.dumps({"time":time.time(),"buckets":list(METRIC_BUCKETS),"metrics":[{"op":op,"token":tk,"channel":ch,**v} for(op,tk,ch),v in sorted(snap.items())]},indent=1)
+
+def metrics_prometheus(snap):
+    out=["# TYPE drivecord_op_seconds histogram"]
+    for(op,tk,ch),v in sorted(snap.items()):
+        lb=f'op="{op}",token="{tk}",channel="{ch}"'
+        acc=0
+        for le,c in zip(list(METRIC_BUCKETS)+["+Inf"],v["buckets"]):
+            acc+= c
+            out.append(f'drivecord_op_seconds_bucket{{{lb},le="{le}"}} {acc}')
+        out.append(f"drivecord_op_seconds_sum{{{lb}}} {v['sum']:.6f}")
+        out.append(f"drivecord_op_seconds_count{{{lb}}} {v['count']}")
+    out.append("# TYPE drivecord_op_total counter")
+    out+=[f'drivecord_op_total{{op="{op}",token="{tk}",channel="{ch}"}} {v["count"]}' for(op,tk,ch),v in sorted(snap.items())]
+    out.append("# TYPE drivecord_op_errors_total counter")
+    out+=[f'drivecord_op_errors_total{{op="{op}",token="{tk}",channel="{ch}"}} {v["errors"]}' for(op,tk,ch),v in sorted(snap.items())]
+    out.append("# TYPE drivecord_op_bytes_total counter")
+    out+=[f'drivecord_op_bytes_total{{op="{op}",token="{tk}",channel="{ch}"}} {v["bytes"]}' for(op,tk,ch),v in sorted(snap.items())]
+    return"\n".join(out)+"\n"
+
+def export_metrics(path):
+    snap= metrics_snapshot()
+    body= metrics_json(snap) if path.endswith(".json") else metrics_prometheus(snap)
+    with open(path+".tmp","w",encoding="utf-8")as f:f.write(body)
+    os.replace(path+".tmp",path)
+
+def metrics_exporter(cfg):
+    while not STOP_WORKERS:
+        path= cfg.get("metrics_file","")
+        if path:
+            try:export_metrics(path)
+            except OSError:pass
+        t= time.time()+max(1,cfg.get("metrics_interval",METRICS_INTERVAL))
+        while not STOP_WORKERS and time.time()<t:time.sleep(0.2)
+    if cfg.get("metrics_file"):
+        try:export_metrics(cfg["metrics_file"])
+        except OSError:pass
+
+def start_metrics(cfg):
+    th= threading.Thread(target=metrics_exporter,args=(cfg,),daemon=True)
+    th.start()
+    worker_threads.append(th)
+
 def valid_ids(sv,ch):
     if(not sv.isdigit())or(not ch.isdigit())or(not sv)or(not ch):
         return(False,"Invalid server/channel ID")
     return(True,None)
 
-def test_token(tok):
-    url="https://discord.com/api/v10/users/@me"
-    hd={"Authorization":f"Bot {tok}"}
+async def atest_token(tok):
     try:
-        r=requests.get(url,headers=hd)
+        r,_= await adiscord_request(tok,"GET",f"{API_BASE}/users/@me","GET /users/@me")
         if r.status_code==200:return(True,None)
         return(False,f"HTTP {r.status_code}: {r.text}")
     except Exception as e:return(False,str(e))
 
+async def verify_tokens(toks):
+    return await asyncio.gather(*(atest_token(t) for t in toks))
+
 def background_token_verifier(cfg):
-    local={}
-    for t in cfg["bot_tokens"]:
-        ok,e=test_token(t)
-        local[t]= ok
+    toks= list(cfg["bot_tokens"])
+    eng= engine
+    res= eng.call(verify_tokens(toks)) if eng else[drive(atest_token(t)) for t in toks]
+    local={t:ok for t,(ok,_) in zip(toks,res)}
     with token_validity_lock:
         global token_validity_map
         token_validity_map= local
 
-def build_tree_lines(dirnode,indent="",is_last=True):
+def build_tree_lines(dirnode,indent="",is_last=True,path="root"):
+    hit= tree_cache.get(path)
+    if hit and hit[0]==indent and hit[1]==is_last and hit[2] is dirnode:return hit[3]
     lines=[]
     prefix="└── " if is_last else"├── "
     expanded=dirnode.get("expanded",False)
@@ -101,7 +750,7 @@ def build_tree_lines(dirnode,indent="",is_last=True):
     idx=0
     for sb in dirnode["subdirs"]:
         last=(idx==tk-1)
-        lines.extend(build_tree_lines(sb,cindent,last))
+        lines.extend(build_tree_lines(sb,cindent,last,path+"/"+sb["name"]))
         idx+=1
     for f in dirnode["files"]:
         last=(idx==tk-1)
@@ -109,150 +758,479 @@ def build_tree_lines(dirnode,indent="",is_last=True):
         ln= f"{cindent}{pr}{f['file_name']} [ID={f['file_id']}]"
         lines.append((ln,"file",f))
         idx+=1
+    tree_cache[path]=(indent,is_last,dirnode,lines)
     return lines
 
-def find_subdir(parent,name):
-    for sb in parent["subdirs"]:
-        if sb["name"]== name:return sb
-    return None
+def invalidate_tree(path):
+    while path:
+        tree_cache.pop(path,None)
+        path= path.rpartition("/")[0]
 
-def remove_file_record(cfg,fid):
-    def dfs(d):
-        filtered=[]
-        for ff in d["files"]:
-            if ff["file_id"]==fid:pass
-            else:filtered.append(ff)
-        d["files"]= filtered
+def index_tree(cfg):
+    file_index.clear()
+    dir_index.clear()
+    dir_paths.clear()
+    tree_cache.clear()
+    def dfs(d,path):
+        index_dir(path,d)
+        for f in d["files"]:
+            file_index[f["file_id"]]=(d,f)
         for sb in d["subdirs"]:
-            dfs(sb)
-    dfs(cfg["directories"])
-    save_config(cfg)
+            dfs(sb,path+"/"+sb["name"])
+    dfs(cfg["directories"],"root")
 
-def find_file(cfg,fid):
-    def dfs(d):
-        for ff in d["files"]:
-            if ff["file_id"]==fid:return(d,ff)
+def index_dir(path,node):
+    dir_index[path]= node
+    dir_paths[id(node)]= path
+
+def unindex_dir(path):
+    def dfs(d,p):
+        dir_index.pop(p,None)
+        dir_paths.pop(id(d),None)
+        tree_cache.pop(p,None)
+        for f in d["files"]:
+            file_index.pop(f["file_id"],None)
         for sb in d["subdirs"]:
-            r=dfs(sb)
-            if r[0]is not None:return r
-        return(None,None)
-    return dfs(cfg["directories"])
+            dfs(sb,p+"/"+sb["name"])
+    node= dir_index.get(path)
+    if node is not None:dfs(node,path)
 
-def move_file_record(cfg,fid,pathlst):
-    od,fo= find_file(cfg,fid)
-    if not fo:return
-    od["files"]=[x for x in od["files"] if x["file_id"]!=fid]
-    root= cfg["directories"]
-    c= root
+def remove_file_record(cfg,fid):
+    d,f= file_index.pop(fid,(None,None))
+    if d is not None:
+        d["files"]=[x for x in d["files"] if x is not f]
+        invalidate_tree(dir_path_of(cfg,d))
+        if not f.get("in_process"):note_manifest(cfg,{"op":"del","file_id":fid})
+    db_delete_file(fid)
+
+def dir_path_of(cfg,node):
+    return dir_paths.get(id(node))
+
+def ensure_dir(cfg,pathlst):
+    c= cfg["directories"]
+    path="root"
     for nm in pathlst[1:]:
-        sb= find_subdir(c,nm)
+        path+="/"+nm
+        sb= dir_index.get(path)
         if not sb:
             sb={"name":nm,"files":[],"subdirs":[],"expanded":False}
             c["subdirs"].append(sb)
+            index_dir(path,sb)
+            invalidate_tree(path)
+            db_put_dir(path,sb)
         c= sb
+    return c,path
+
+def dir_path_list(dd):
+    sp=[x for x in dd.split("/") if x.strip()]
+    if not sp or sp[0].lower()!="root": sp=["root"]+sp
+    return sp
+
+def set_expanded(cfg,node,val):
+    node["expanded"]= val
+    path= dir_path_of(cfg,node)
+    if path:
+        invalidate_tree(path)
+        db_put_dir(path,node)
+
+def find_file(cfg,fid):
+    return file_index.get(fid,(None,None))
+
+def add_file_record(cfg,pathlst,fobj):
+    c,path= ensure_dir(cfg,pathlst)
+    c["files"].append(fobj)
+    file_index[fobj["file_id"]]=(c,fobj)
+    invalidate_tree(path)
+    db_put_file(path,fobj)
+
+def move_file_record(cfg,fid,pathlst):
+    od,fo= find_file(cfg,fid)
+    if not fo:return
+    od["files"]=[x for x in od["files"] if x is not fo]
+    invalidate_tree(dir_path_of(cfg,od))
+    c,path= ensure_dir(cfg,pathlst)
     c["files"].append(fo)
-    save_config(cfg)
+    file_index[fid]=(c,fo)
+    invalidate_tree(path)
+    db_move_file(fid,path)
+    if not fo.get("in_process"):note_manifest(cfg,{"op":"move","file_id":fid,"path":path})
 
-def delete_dir(cfg,dirname):
-    def dfs(par,node):
-        if node["name"]==dirname and par is not None:
-            par["subdirs"]=[x for x in par["subdirs"] if x is not node]
-            return True
-        for s in node["subdirs"]:
-            if dfs(node,s):return True
-        return False
-    dfs(None,cfg["directories"])
-    save_config(cfg)
+def delete_dir(cfg,path):
+    par,_,nm= path.rpartition("/")
+    parent= dir_index.get(par)
+    node= dir_index.get(path)
+    if parent is None or node is None:return
+    parent["subdirs"]=[x for x in parent["subdirs"] if x is not node]
+    unindex_dir(path)
+    invalidate_tree(par)
+    db_delete_dir(path)
+    note_manifest(cfg,{"op":"rmdir","path":path})
 
 def finalize_upload(cfg,fid):
     d,f= find_file(cfg,fid)
     if f:
         f["in_process"]=False
-        save_config(cfg)
-
-def chunk_file(fp):
-    try:
-        sz=os.path.getsize(fp)
-        if sz<=0:
-            yield(0,b'')
-            return
-        with open(fp,"rb")as f:
-            idx=0
-            while True:
-                dd= f.read(CHUNK_SIZE)
-                if not dd: break
-                yield(idx,dd)
-                idx+=1
-    except:pass
+        db_update_file(f)
+        note_manifest(cfg,{"op":"put","path":dir_path_of(cfg,d),"record":manifest_record(f)})
 
 def generate_fid():
     c="ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
     return"".join(random.choice(c) for _ in range(8))
 
-def up_chunk(token,channel,data,filename,fileid,ck):
-    url=f"https://discord.com/api/v9/channels/{channel}/messages"
-    hd={"Authorization":f"Bot {token}"}
-    dt={"content":f"FILEID:{fileid} CHUNK:{ck}"}
-    fs={"files[0]":(filename,data,"application/octet-stream")}
-    try:
-        r=requests.post(url,headers=hd,data=dt,files=fs)
-        return(r.status_code in (200,201,204))
-    except:return False
+def header_param(v):
+    return v.translate({10:"%0A",13:"%0D",34:"%22"})
+
+class MultipartBody:
+    def __init__(self,fields,files):
+        bd= "drivecord"+os.urandom(12).hex()
+        self.content_type= f"multipart/form-data; boundary={bd}"
+        parts=[]
+        for k,v in fields.items():
+            parts.append(f'--{bd}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+        for i,(fn,data) in enumerate(files):
+            parts.append(f'--{bd}\r\nContent-Disposition: form-data; name="files[{i}]"; filename="{header_param(fn)}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+            parts.append(data)
+            parts.append(b"\r\n")
+        parts.append(f"--{bd}--\r\n".encode())
+        self.parts=[memoryview(x).cast("B") for x in parts]
+        self.size= sum(len(x) for x in self.parts)
+        self.seek(0)
+
+    def __len__(self):return self.size
+
+    def tell(self):return self.pos
+
+    def seek(self,pos,whence=0):
+        if whence==1:pos+= self.pos
+        elif whence==2:pos+= self.size
+        self.pos= max(0,min(pos,self.size))
+        self.cur=0
+        self.off= self.pos
+        while self.cur<len(self.parts) and self.off>=len(self.parts[self.cur]):
+            self.off-= len(self.parts[self.cur])
+            self.cur+=1
+        return self.pos
+
+    def read(self,n=-1):
+        if n is None or n<0:
+            out= b"".join(self.parts[self.cur:])[self.off:]
+            self.seek(self.size)
+            return out
+        while self.cur<len(self.parts) and self.off>=len(self.parts[self.cur]):
+            self.cur+=1
+            self.off=0
+        if self.cur>=len(self.parts):return b""
+        out= self.parts[self.cur][self.off:self.off+n]
+        self.off+= len(out)
+        self.pos+= len(out)
+        return out
+
+async def aup_chunk(tokens,channel,files,fileid,cks,meta=""):
+    url=f"{API_BASE}/channels/{channel}/messages"
+    dt={"content":f"FILEID:{fileid} CHUNK:{','.join(str(c) for c in cks)} {meta}".strip()}
+    body= MultipartBody(dt,files)
+    t0= time.perf_counter()
+    r,tok=None,"-"
+    try:r,tok= await adiscord_request(tokens,"POST",url,f"POST /channels/{channel}/messages",data=body,headers={"Content-Type":body.content_type})
+    except Exception:pass
+    return chunk_reply(r,tok,channel,files,t0)
+
+def chunk_reply(r,tok,channel,files,t0):
+    ok= r is not None and r.status_code in(200,201)
+    metric_observe("upload_chunk",tok,channel,time.perf_counter()-t0,sum(len(d) for _,d in files),ok)
+    if ok:
+        try:return r.json()
+        except:pass
+    return None
+
+def chunk_entries(msg,names):
+    a= msg.get("attachments",[])
+    if len(a)!=len(names):return None
+    byname={x.get("filename"):x for x in a}
+    if all(nm in byname for nm in names):a=[byname[nm] for nm in names]
+    return[{"message_id":msg["id"],"attachment_id":x["id"],"size":x.get("size",0)} for x in a]
+
+def parse_caption(c):
+    sp= c.split()
+    if len(sp)<2 or not sp[0].startswith("FILEID:") or not sp[1].startswith("CHUNK:"):return None,[]
+    try:return sp[0][7:],[int(x) for x in sp[1][6:].split(",")]
+    except ValueError:return None,[]
+
+def caption_fields(c):
+    return dict(x.split(":",1) for x in c.split()[2:] if ":" in x)
+
+def caption_meta(f):
+    m= f"OF:{f['chunk_count']} SIZE:{f['size']} CS:{f['chunk_size']}"
+    if f.get("parity"):m+= f" PAR:{f['parity']['k']},{f['parity']['m']}"
+    return m
 
-def fetch_msg(token,channel,lim=100):
-    url=f"https://discord.com/api/v9/channels/{channel}/messages?limit={lim}"
-    hd={"Authorization":f"Bot {token}"}
+def fetch_msg(token,channel,lim=100,before=None,after=None):
+    url=f"{API_BASE}/channels/{channel}/messages?limit={lim}"
+    if before:url+=f"&before={before}"
+    if after:url+=f"&after={after}"
     try:
-        r=requests.get(url,headers=hd)
+        r,_=discord_request(token,"GET",url,f"GET /channels/{channel}/messages")
         if r.status_code==200:return r.json()
     except:pass
-    return[]
+    return None
+
+def fetch_page(cfg,tid,tk,ch,lim=100,**kw):
+    msgs= fetch_msg(tk,ch,lim,**kw)
+    n=0
+    while msgs is None and n<cfg.get("chunk_retries",CHUNK_RETRIES) and drive(aretry_wait(tid,n)):
+        metric_count("scan_retry",tk,ch)
+        n+=1
+        msgs= fetch_msg(tk,ch,lim,**kw)
+    return msgs
+
+async def aget_msg(token,channel,mid):
+    url=f"{API_BASE}/channels/{channel}/messages/{mid}"
+    try:
+        r,_= await adiscord_request(token,"GET",url,f"GET /channels/{channel}/messages/:id")
+        if r.status_code==200:return r.json()
+    except Exception:pass
+    return None
+
+async def aattach_url(token,channel,ent,urls=None):
+    if urls is not None and ent["attachment_id"] in urls:return urls[ent["attachment_id"]]
+    mm= await aget_msg(token,channel,ent["message_id"])
+    if not mm:return None
+    uu=None
+    for a in mm.get("attachments",[]):
+        if urls is not None:urls[a.get("id")]= a.get("url")
+        if a.get("id")==ent["attachment_id"]:uu= a.get("url")
+    return uu
 
-def dl_attach(url,token):
-    hd={"Authorization":f"Bot {token}"}
+async def adl_attach(url,token):
     try:
-        r=requests.get(url,headers=hd)
+        r,_= await adiscord_request(token,"GET",url,"cdn")
         if r.status_code==200:return r.content
-    except:pass
+    except Exception:pass
+    return None
+
+async def adl_attach_range(url,token,off,ln):
+    try:
+        r,_= await adiscord_request(token,"GET",url,"cdn",headers={"Range":f"bytes={off}-{off+ln-1}"})
+        if r.status_code==206:return r.content
+        if r.status_code==200:return r.content[off:off+ln]
+    except Exception:pass
     return None
 
-def queue_download(cfg,fid):
-    dt="download_"+str(random.randint(10000,99999))
+def register_task(prefix,task):
+    tid= f"{prefix}_{next(task_ids)}"
     with active_tasks_lock:
-        active_tasks[dt]={
-            "type":"download",
-            "file_id":fid,
-            "progress":0,
-            "total":0,
-            "status":"Downloading...",
-            "finished":False
-        }
-    tasks_queue.put((dt,active_tasks[dt]))
+        active_tasks[tid]= task
+        live_tasks[tid]= task
+    evict_tasks()
+    return tid
+
+def finish_task(tid):
+    with active_tasks_lock:
+        t= live_tasks.pop(tid,None)
+        if t is None:return
+        t["finished"]= True
+        ended_tasks.append((time.time(),tid))
+
+def evict_tasks():
+    cut= time.time()-TASK_RETENTION
+    gone=[]
+    with active_tasks_lock:
+        while ended_tasks and ended_tasks[0][0]<=cut:
+            _,tid= ended_tasks.popleft()
+            active_tasks.pop(tid,None)
+            gone.append(tid)
+    for tid in gone:tasks_queue.forget(tid)
+
+def set_chunk_state(ft,idxs,val):
+    with active_tasks_lock:
+        t= active_tasks.get(ft)
+        cs= t.get("chunk_state") if t else None
+        if cs is None:return
+        for i in idxs:cs[i]= val
+
+def queue_download(cfg,fid,dest=None):
+    dt= register_task("download",{
+        "type":"download",
+        "file_id":fid,
+        "dest":dest,
+        "priority":PRIO_INTERACTIVE,
+        "progress":0,
+        "total":0,
+        "bytes":0,
+        "status":"Downloading...",
+        "finished":False
+    })
+    tasks_queue.put((dt,active_tasks[dt]),dt,PRIO_INTERACTIVE)
+    return dt
 
 def do_chunk_upload(tid,inf,cfg):
-    tk=inf["token"]
-    if tk=="NO_TOKENS":tk=None
-    if not tk:
-        with active_tasks_lock:
-            active_tasks[tid]["status"]="No tokens"
-        return
-    fid=inf["file_id"]
-    cidx=inf["chunk_idx"]
-    data=inf["chunk_data"]
-    pf=inf["part_filename"]
-    sc= up_chunk(tk,cfg["channel_id"],data,pf,fid,cidx)
-    if not sc:
-        with active_tasks_lock:
-            active_tasks[tid]["status"]=f"Chunk {cidx} fail"
+    drive(achunk_upload(cfg,inf))
+
+async def achunk_upload(cfg,inf):
+    try:await aupload_chunk(cfg,inf)
+    finally:
+        if inf.get("window"):
+            for _ in inf["parts"]:inf["window"].release()
+        inf["parts"]=[]
+
+async def aupload_chunk(cfg,inf):
+    tokens= cfg["bot_tokens"]
+    cks=[p["idx"] for p in inf["parts"]]
+    retries= cfg.get("chunk_retries",CHUNK_RETRIES)
+    ft=inf["file_task_id"]
+    if not tokens:
+        chunk_failed(ft,cks,"No tokens")
         return
+    set_chunk_state(ft,cks,CHUNK_SENDING)
+    if inf.get("compression"):files,codecs,meta= await offload(chunk_payload,cfg,inf)
+    else:files,codecs,meta= chunk_payload(cfg,inf)
+    chs= storage_channels(cfg)
+    n=0
+    while True:
+        ch= pick_channel(tokens,chs)
+        msg= await aup_chunk(tokens,ch,files,inf["file_id"],cks,meta)
+        ents= chunk_entries(msg,[fn for fn,_ in files]) if msg else None
+        if ents:break
+        if n>=retries or STOP_WORKERS:
+            chunk_failed(ft,cks,f"Chunk {','.join(str(c) for c in cks)} failed, will resume on restart")
+            return
+        metric_count("chunk_retry","-",ch)
+        await nap(backoff_delay(n))
+        n+=1
+    files=None
+    await offload(chunk_sent,cfg,inf,ch,ents,codecs)
+
+def chunk_payload(cfg,inf):
+    files=[]
+    codecs=[]
+    for p in inf["parts"]:
+        payload,codec= encode_chunk(cfg,p["data"],inf.get("compression"))
+        files.append((f"{inf['base_name']}.part{p['idx']}",payload))
+        codecs.append(codec)
+    meta= inf.get("meta","")
+    if any(codecs):meta+=" CODEC:"+",".join(c or"-" for c in codecs)
+    return files,codecs,meta
+
+def chunk_failed(ft,cks,msg):
+    with active_tasks_lock:
+        if ft in active_tasks:active_tasks[ft]["status"]= msg
+    set_chunk_state(ft,cks,CHUNK_FAILED)
+    finish_task(ft)
+    notify_progress()
+
+def chunk_sent(cfg,inf,ch,ents,codecs):
     ft=inf["file_task_id"]
+    for p,ent,codec in zip(inf["parts"],ents,codecs):
+        ent["channel_id"]= ch
+        if codec:ent["codec"]= codec
+        db_put_hash(p["hash"],dict(ent))
+        ent["hash"]= p["hash"]
+        chunk_landed(cfg,ft,inf["file_id"],p["idx"],ent,len(p["data"]),False)
+
+def attachments_per_message(cfg,chunk_sz):
+    per= min(MAX_ATTACHMENTS,int(cfg.get("attachments_per_message",MAX_ATTACHMENTS)))
+    return max(1,min(per,MESSAGE_SIZE_LIMIT//max(1,chunk_sz)))
+
+def enqueue_chunks(tid,fid,base,parts,comp,window,meta=""):
+    cid= f"chunk_{next(task_ids)}"
+    set_chunk_state(tid,[p["idx"] for p in parts],CHUNK_QUEUED)
+    tasks_queue.put((cid,{
+        "type":"chunk_upload",
+        "file_id": fid,
+        "parts": parts,
+        "base_name": base,
+        "compression": comp,
+        "file_task_id": tid,
+        "window": window,
+        "meta": meta
+    }),tid,PRIO_BULK)
+
+def enqueue_refs(tid,fid,base,refs,meta):
+    cid= f"chunk_{next(task_ids)}"
+    set_chunk_state(tid,[r["idx"] for r in refs],CHUNK_QUEUED)
+    tasks_queue.put((cid,{
+        "type":"chunk_ref",
+        "file_id": fid,
+        "refs": refs,
+        "base_name": base,
+        "file_task_id": tid,
+        "meta": meta
+    }),tid,PRIO_BULK)
+
+def ref_field(cfg,ent):
+    ch= ent.get("channel_id") or cfg["channel_id"]
+    return f"{ch}/{ent['message_id']}/{ent['attachment_id']}/{ent['size']}/{ent.get('codec') or '-'}"
+
+def ref_entries(v):
+    out=[]
+    try:
+        for x in v.split(","):
+            ch,mid,aid,size,codec= x.split("/")
+            ent={"channel_id":ch,"message_id":mid,"attachment_id":aid,"size":int(size)}
+            if codec!="-":ent["codec"]= codec
+            out.append(ent)
+    except ValueError:return None
+    return out
+
+def post_refs(tid,inf,cfg):
+    tokens= cfg["bot_tokens"]
+    refs= inf["refs"]
+    cks=[r["idx"] for r in refs]
+    retries= cfg.get("chunk_retries",CHUNK_RETRIES)
+    ft=inf["file_task_id"]
+    if not tokens:
+        chunk_failed(ft,cks,"No tokens")
+        return
+    set_chunk_state(ft,cks,CHUNK_SENDING)
+    meta= f"{inf['meta']} NAME:{quote(inf['base_name'])} REF:"+",".join(ref_field(cfg,r["ent"]) for r in refs)
+    chs= storage_channels(cfg)
+    n=0
+    while not drive(aup_chunk(tokens,pick_channel(tokens,chs),[],inf["file_id"],cks,meta)):
+        if n>=retries or STOP_WORKERS:
+            chunk_failed(ft,cks,f"Chunk {','.join(str(c) for c in cks)} failed, will resume on restart")
+            return
+        metric_count("chunk_retry","-","-")
+        time.sleep(backoff_delay(n))
+        n+=1
+    for r in refs:chunk_landed(cfg,ft,inf["file_id"],r["idx"],r["ent"],r["size"],True)
+
+def chunk_landed(cfg,ft,fid,cidx,ent,nbytes,deduped):
+    if tasks_queue.cancelled(ft):return
+    done=False
+    members=[]
     with active_tasks_lock:
         if ft in active_tasks:
-            active_tasks[ft]["progress"]+=1
-            if active_tasks[ft]["progress"]== active_tasks[ft]["total"]:
-                active_tasks[ft]["status"]="Upload complete"
-                finalize_upload(cfg,fid)
-        active_tasks[tid]["status"]=f"Chunk {cidx} done"
+            t= active_tasks[ft]
+            members= t.get("members",[])
+            rec= t["record"]
+            if rec and cidx<rec["chunk_count"]:rec["chunks"][cidx]= ent
+            elif rec:rec["parity_chunks"][cidx-rec["chunk_count"]]= ent
+            for r in members:r["chunks"][0]= ent
+            t["chunk_state"][cidx]= CHUNK_DONE
+            t["progress"]+=1
+            t["bytes"]+= nbytes
+            if deduped:
+                t["bytes_base"]+= nbytes
+                t["deduped"]= t.get("deduped",0)+1
+            done= t["progress"]== t["total"]
+            if done:
+                t["status"]="Upload complete"
+                if t.get("deduped"):t["status"]+=f" ({t['deduped']} chunks deduplicated)"
+    notify_progress()
+    if members:
+        for r in members:
+            db_put_chunk(r["file_id"],0,ent)
+            finalize_upload(cfg,r["file_id"])
+        finish_task(ft)
+        return
+    db_put_chunk(fid,cidx,ent)
+    if done:
+        finalize_upload(cfg,fid)
+        finish_task(ft)
+
+def backoff_delay(n):
+    d= min(RETRY_MAX_DELAY,RETRY_BASE_DELAY*(2**n))
+    return d/2+random.uniform(0,d/2)
 
 def do_download(tid,inf,cfg):
     fid= inf["file_id"]
@@ -263,62 +1241,644 @@ def do_download(tid,inf,cfg):
         return
     chunkcount= f["chunk_count"]
     fname= f["file_name"]
-    folder="Drivecord Downloads"
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+    folder= inf.get("dest") or"Drivecord Downloads"
+    os.makedirs(folder,exist_ok=True)
     outp= os.path.join(folder,fname)
-    got={}
     tokens= cfg["bot_tokens"]
     if not tokens:
         with active_tasks_lock:
             active_tasks[tid]["status"]="No tokens"
         return
+    mp= f.get("chunks")
+    if f.get("pack"):job= adownload_packed(tid,cfg,f,outp,tokens)
+    elif f.get("parity") and mp and f.get("parity_chunks"):
+        download_parity(tid,cfg,f,outp,tokens)
+        return
+    else:
+        if not(mp and len(mp)==chunkcount and all(mp)):
+            mp= scan_chunk_map(cfg,fid,chunkcount,tokens)
+        if mp is None:
+            with active_tasks_lock:active_tasks[tid]["status"]="Download incomplete"
+            return
+        job= adownload_mapped(tid,cfg,f,mp,outp,tokens)
+    eng= engine
+    if eng:eng.call(job)
+    else:drive(job)
+
+async def adownload_packed(tid,cfg,f,outp,tokens):
+    ent= f["chunks"][0]
+    off= f["pack"]["offset"]
+    ln= f["pack"]["length"]
+    with active_tasks_lock:
+        active_tasks[tid]["started"]= time.time()
+        active_tasks[tid]["bytes_total"]= ln
+    dd=None
+    for tk in tokens:
+        n=0
+        while True:
+            dd= await afetch_pack_slice(cfg,ent,tk,off,ln)
+            if dd is not None or n>=cfg.get("chunk_retries",CHUNK_RETRIES) or not await aretry_wait(tid,n):break
+            n+=1
+        if dd is not None:break
+    if dd is None:
+        with active_tasks_lock:active_tasks[tid]["status"]="Download incomplete"
+        return
+    with open(outp,"wb")as out:
+        out.write(dd)
+    note_download_progress(tid,1,1,ln)
+    with active_tasks_lock:
+        active_tasks[tid]["status"]= f"Download complete, file saved to: {outp}"
+
+async def afetch_pack_slice(cfg,ent,tk,off,ln):
+    uu= await aattach_url(tk,ent_channel(cfg,ent),ent)
+    if not uu:return None
+    if ent.get("codec"):
+        dd= await afetch_chunk(cfg,ent,tk)
+        if dd is not None:dd= dd[off:off+ln]
+    elif ln>0:dd= await adl_attach_range(uu,tk,off,ln)
+    else:dd=b""
+    return dd if dd is not None and len(dd)==ln else None
+
+def note_download_progress(tid,downloaded,chunkcount,nbytes):
+    with active_tasks_lock:
+        active_tasks[tid]["progress"]= downloaded
+        active_tasks[tid]["total"]= chunkcount
+        active_tasks[tid]["bytes"]+= nbytes
+        active_tasks[tid]["status"]="Downloading..."
+    notify_progress()
+
+def task_rate(t):
+    el= time.time()-t.get("started",time.time())
+    done= t.get("bytes",0)-t.get("bytes_base",0)
+    if el<=0 or done<=0:return""
+    rate= done/el
+    left= max(0,t.get("bytes_total",0)-t.get("bytes",0))
+    if t.get("progress",0)>=t.get("total",0):return f"{rate/1048576:.1f} MB/s"
+    return f"{rate/1048576:.1f} MB/s ETA {int(left/rate)}s"
+
+async def afetch_chunk(cfg,ent,tk,urls=None):
+    t0= time.perf_counter()
+    ch= ent_channel(cfg,ent)
+    dd=None
+    uu= await aattach_url(tk,ch,ent,urls)
+    if uu:
+        dd= await adl_attach(uu,tk)
+        if dd is None and urls is not None:urls.pop(ent["attachment_id"],None)
+    if dd is not None and ent.get("codec"):
+        try:dd= await offload(decompress_chunk,dd,ent["codec"])
+        except(zlib.error,lzma.LZMAError):dd=None
+    metric_observe("fetch",tk,ch,time.perf_counter()-t0,len(dd) if dd else 0,dd is not None)
+    return dd
+
+async def afetch_retry(cfg,tid,ent,tk,urls=None):
+    dd= await afetch_chunk(cfg,ent,tk,urls)
+    n=0
+    while dd is None and n<cfg.get("chunk_retries",CHUNK_RETRIES) and await aretry_wait(tid,n):
+        metric_count("fetch_retry",tk,ent_channel(cfg,ent))
+        n+=1
+        dd= await afetch_chunk(cfg,ent,tk,urls)
+    return dd
+
+async def aretry_wait(tid,n):
+    end= time.time()+backoff_delay(n)
+    while time.time()<end:
+        if STOP_WORKERS or tasks_queue.cancelled(tid):return False
+        await nap(min(0.1,end-time.time()))
+    return not STOP_WORKERS and not tasks_queue.cancelled(tid)
+
+def chunk_offsets(f,mp):
+    cs= f.get("chunk_size")
+    if cs:return[i*cs for i in range(len(mp))]
+    offs=[]
+    o=0
+    for ent in mp:
+        offs.append(o)
+        o+= ent.get("size",0)
+    return offs
+
+async def adownload_mapped(tid,cfg,f,mp,outp,tokens):
+    offs= chunk_offsets(f,mp)
+    total= f.get("size")
+    if total is None:total= offs[-1]+mp[-1].get("size",0)
+    tmp= outp+".part"
+    with open(tmp,"wb")as out:
+        out.truncate(total)
+    pending= deque((i,()) for i in range(len(mp)))
+    st={"done":0,"failed":None}
+    urls={}
+    lk= threading.Lock()
+    wlk= threading.Lock()
+    with active_tasks_lock:
+        active_tasks[tid]["started"]= time.time()
+        active_tasks[tid]["bytes_total"]= total
+    async def run(tk,out):
+        while st["failed"] is None and st["done"]<len(mp):
+            if not await atransfer_may_run(tid):return
+            try:i,tried= pending.popleft()
+            except IndexError:
+                await nap(0.05)
+                continue
+            if tk in tried:
+                pending.append((i,tried))
+                await nap(0.01)
+                continue
+            dd= await afetch_retry(cfg,tid,mp[i],tk,urls)
+            if dd is None:
+                tried+=(tk,)
+                if len(set(tried))>=len(set(tokens)):st["failed"]=i
+                else:pending.append((i,tried))
+                continue
+            await offload(write_at,out,wlk,offs[i],dd)
+            with lk:
+                st["done"]+=1
+                dn= st["done"]
+            note_download_progress(tid,dn,len(mp),len(dd))
+    per= engine.per_token if on_loop() else DOWNLOAD_STREAMS_PER_TOKEN
+    with open(tmp,"r+b")as out:
+        await streams([run(tk,out) for tk in tokens for _ in range(per)])
+    finish_download(tid,tmp,outp,None if st["failed"] is None else f"chunk {st['failed']}")
+
+async def streams(jobs):
+    if on_loop():
+        await asyncio.gather(*jobs)
+        return
+    ths=[threading.Thread(target=drive,args=(j,),daemon=True) for j in jobs]
+    for th in ths:th.start()
+    for th in ths:th.join()
+
+def write_at(out,lk,off,dd):
+    with lk:
+        out.seek(off)
+        out.write(dd)
+
+def finish_download(tid,tmp,outp,err):
+    if tasks_queue.cancelled(tid) or STOP_WORKERS:
+        os.remove(tmp)
+        return
+    if err:
+        os.remove(tmp)
+        with active_tasks_lock:active_tasks[tid]["status"]=f"Download incomplete ({err})"
+        return
+    os.replace(tmp,outp)
+    with active_tasks_lock:
+        active_tasks[tid]["status"]= f"Download complete, file saved to: {outp}"
+
+async def atransfer_may_run(tid):
+    while tasks_queue.paused(tid) and not tasks_queue.cancelled(tid) and not STOP_WORKERS:
+        await nap(0.1)
+    return not tasks_queue.cancelled(tid) and not STOP_WORKERS
+
+def download_parity(tid,cfg,f,outp,tokens):
+    cc= f["chunk_count"]
+    cs= f["chunk_size"]
+    k= f["parity"]["k"]
+    m= f["parity"]["m"]
+    total= f["size"]
+    tmp= outp+".part"
+    with open(tmp,"wb")as out:
+        out.truncate(total)
+    stripes=[]
+    pending=Queue()
+    for s0 in range(0,cc,k):
+        kk= min(k,cc-s0)
+        sn= len(stripes)
+        ents= f["chunks"][s0:s0+kk]+f["parity_chunks"][sn*m:sn*m+m]
+        stripes.append({"s0":s0,"kk":kk,"ents":ents,"have":{},"lost":0,"busy":False,"done":False})
+        for li in range(len(ents)):pending.put((sn,li,()))
+    st={"done":0,"left":len(stripes),"failed":None}
+    written=set()
+    lk= threading.Lock()
+    urls={}
+    with active_tasks_lock:
+        active_tasks[tid]["started"]= time.time()
+        active_tasks[tid]["bytes_total"]= total
+    def wrote(out,idx,dd):
+        out.seek(idx*cs)
+        out.write(dd)
+        out.flush()
+        with lk:
+            if idx in written:return
+            written.add(idx)
+            st["done"]+=1
+            dn= st["done"]
+        note_download_progress(tid,dn,cc,len(dd))
+    def finish(out,sp):
+        ln= min(cs,total-sp["s0"]*cs)
+        want=[i for i in range(sp["kk"]) if i not in sp["have"]]
+        pieces={}
+        for li,dd in sp["have"].items():
+            if not want:break
+            if dd is None:
+                out.seek((sp["s0"]+li)*cs)
+                dd= out.read(min(cs,total-(sp["s0"]+li)*cs))
+            pieces[li]= dd+bytes(ln-len(dd))
+        if want:
+            for i,dd in rs_decode(k,sp["kk"],pieces,want,ln).items():
+                wrote(out,sp["s0"]+i,dd[:min(cs,total-(sp["s0"]+i)*cs)])
+        with lk:
+            sp["done"]=True
+            sp["have"]={}
+            st["left"]-=1
+    def run(tk):
+        with open(tmp,"r+b")as out:
+            while True:
+                with lk:
+                    if st["failed"] is not None or st["left"]==0:return
+                if not drive(atransfer_may_run(tid)):return
+                try:sn,li,tried= pending.get(timeout=0.05)
+                except Empty:continue
+                sp= stripes[sn]
+                if sp["busy"]:continue
+                if tk in tried:
+                    pending.put((sn,li,tried))
+                    time.sleep(0.01)
+                    continue
+                ent= sp["ents"][li]
+                dd= drive(afetch_chunk(cfg,ent,tk,urls)) if ent else None
+                if dd is None:
+                    tried+=(tk,)
+                    if ent and len(set(tried))<len(set(tokens)):
+                        pending.put((sn,li,tried))
+                        continue
+                    with lk:
+                        sp["lost"]+=1
+                        if not sp["busy"] and sp["lost"]>len(sp["ents"])-sp["kk"]:st["failed"]=sp["s0"]//k
+                    continue
+                if li<sp["kk"]:
+                    with lk:
+                        if sp["busy"]:continue
+                    wrote(out,sp["s0"]+li,dd)
+                    dd=None
+                with lk:
+                    if sp["busy"]:continue
+                    sp["have"][li]= dd
+                    if len(sp["have"])<sp["kk"]:continue
+                    sp["busy"]=True
+                finish(out,sp)
+    ths=[threading.Thread(target=run,args=(tk,),daemon=True) for tk in tokens for _ in range(DOWNLOAD_STREAMS_PER_TOKEN)]
+    for th in ths:th.start()
+    for th in ths:th.join()
+    finish_download(tid,tmp,outp,None if st["failed"] is None else f"stripe {st['failed']}")
+
+def scan_chunk_map(cfg,fid,chunkcount,tokens):
+    got={}
     attempt=40
-    start_time=time.time()
-    downloaded=0
     bx=0
-    while downloaded< chunkcount and attempt>0:
+    chs= storage_channels(cfg)
+    while len(got)< chunkcount and attempt>0:
         attempt-=1
         tk= tokens[bx% len(tokens)]
+        ch= chs[bx% len(chs)]
         bx+=1
-        msgs= fetch_msg(tk,cfg["channel_id"],100)
+        msgs= fetch_msg(tk,ch,100)
         if not msgs:continue
         for mm in msgs:
-            if downloaded== chunkcount: break
-            c= mm.get("content","")
-            a= mm.get("attachments",[])
-            if "FILEID:"in c and "CHUNK:"in c:
-                try:
-                    sp= c.split()
-                    fi= sp[0].split("FILEID:")[1]
-                    ck= int(sp[1].split("CHUNK:")[1])
-                    if fi== fid and ck not in got:
-                        if len(a)==1:
-                            uu=a[0].get("url","")
-                            dd= dl_attach(uu,tk)
-                            if dd is not None:
-                                got[ck]= dd
-                                downloaded+=1
-                                now= time.time()
-                                elapsed= now- start_time
-                                avg=0
-                                if downloaded>0: avg= elapsed/downloaded
-                                remain= chunkcount- downloaded
-                                eta= int(remain* avg)
-                                with active_tasks_lock:
-                                    active_tasks[tid]["progress"]= downloaded
-                                    active_tasks[tid]["total"]= chunkcount
-                                    active_tasks[tid]["status"]= f"Downloading... ETA: {eta}s"
-                except:pass
+            fi,cks= parse_caption(mm.get("content",""))
+            if fi!= fid:continue
+            ents= chunk_entries(mm,[None]*len(cks))
+            if not ents:continue
+            for ck,ent in zip(cks,ents):
+                ent["channel_id"]= ch
+                if 0<=ck<chunkcount and ck not in got:got[ck]= ent
         time.sleep(0.01)
-    if len(got)!= chunkcount:
-        with active_tasks_lock:active_tasks[tid]["status"]="Download incomplete"
+    if len(got)!= chunkcount:return None
+    return[got[i] for i in range(chunkcount)]
+
+def queue_rebuild(cfg):
+    tid= register_task("rebuild",{
+        "type":"rebuild",
+        "progress":0,
+        "total":0,
+        "status":"Scanning channel history...",
+        "finished":False
+    })
+    th= threading.Thread(target=rebuild_index,args=(tid,cfg),daemon=True)
+    th.start()
+
+def rebuild_index(tid,cfg):
+    tokens= cfg["bot_tokens"]
+    if not tokens:
+        with active_tasks_lock:active_tasks[tid]["status"]="No tokens"
+        finish_task(tid)
         return
-    with open(outp,"wb")as out:
-        for i in range(chunkcount):
-            out.write(got[i])
+    ranges=Queue()
+    nr=0
+    st={"msgs":0,"failed":[]}
+    for ch in storage_channels(cfg):
+        newest= fetch_page(cfg,tid,tokens[0],ch,1)
+        if newest is None:st["failed"].append((ch,0,0))
+        if not newest:continue
+        lo= int(ch)
+        hi= int(newest[0]["id"])
+        step= (hi-lo)//(REBUILD_RANGES_PER_TOKEN*len(tokens))+1
+        for a in range(lo,hi,step):
+            ranges.put((ch,a,min(hi,a+step)))
+            nr+=1
+    with active_tasks_lock:active_tasks[tid]["total"]= nr
+    found={}
+    lk= threading.Lock()
+    def run(tk):
+        while not STOP_WORKERS:
+            try:ch,lo,hi= ranges.get_nowait()
+            except Empty:return
+            if not scan_range(cfg,tid,tk,ch,lo,hi,found,lk,st):
+                with lk:st["failed"].append((ch,lo,hi))
+            with lk:line=f"Scanned {st['msgs']} messages, {len(found)} files"
+            with active_tasks_lock:
+                active_tasks[tid]["progress"]+=1
+                active_tasks[tid]["status"]= line
+            notify_progress()
+    ths=[threading.Thread(target=run,args=(tk,),daemon=True) for tk in tokens]
+    for th in ths:th.start()
+    for th in ths:th.join()
+    known={f["pack"]["id"] for _,f in list(file_index.values()) if f.get("pack")}
+    added=0
+    bad=0
+    for fid,got in found.items():
+        if fid in file_index or fid in known:continue
+        rec= recovered_record(fid,got)
+        if rec is None:
+            bad+=1
+            continue
+        add_file_record(cfg,["root","Recovered"],rec)
+        db_put_chunks(fid,[(i,e) for i,e in enumerate(rec["chunks"]+rec.get("parity_chunks",[])) if e])
+        added+=1
+    line= f"Rebuild done: {added} files recovered, {bad} incomplete"
+    if st["failed"]:
+        chs= ",".join(sorted({ch for ch,_,_ in st["failed"]}))
+        line+= f"; could not scan {len(st['failed'])} range(s) in channel {chs}, run it again"
     with active_tasks_lock:
-        active_tasks[tid]["status"]= f"Download complete, file saved to: {outp}"
+        active_tasks[tid]["status"]= line
+    finish_task(tid)
+    notify_progress()
+
+def scan_range(cfg,tid,tk,ch,lo,hi,found,lk,st):
+    cur= hi+1
+    while not STOP_WORKERS:
+        msgs= fetch_page(cfg,tid,tk,ch,before=cur)
+        if msgs is None:return False
+        if not msgs:return True
+        for mm in msgs:
+            if int(mm["id"])>lo:note_caption(ch,mm,found,lk)
+        with lk:st["msgs"]+= len(msgs)
+        cur= min(int(mm["id"]) for mm in msgs)
+        if cur<=lo or len(msgs)<100:return True
+    return False
+
+def note_caption(ch,mm,found,lk):
+    c= mm.get("content","")
+    fi,cks= parse_caption(c)
+    if not fi:return
+    fl= caption_fields(c)
+    ents= ref_entries(fl["REF"]) if "REF" in fl else chunk_entries(mm,[None]*len(cks))
+    if not ents or len(ents)!=len(cks):return
+    codecs= fl.get("CODEC","").split(",")
+    names=[a.get("filename","") for a in mm.get("attachments",[])]
+    name= unquote(fl["NAME"]) if "NAME" in fl else names[0].rpartition(".part")[0]
+    with lk:
+        got= found.setdefault(fi,{"pieces":{},"fields":fl,"name":name or fi,"first":int(mm["id"])})
+        got["first"]= min(got["first"],int(mm["id"]))
+        for i,(ck,ent) in enumerate(zip(cks,ents)):
+            ent.setdefault("channel_id",ch)
+            if i<len(codecs) and codecs[i] not in("","-"):ent["codec"]= codecs[i]
+            got["pieces"].setdefault(ck,ent)
+
+def recovered_record(fid,got):
+    fl= got["fields"]
+    ps= got["pieces"]
+    try:
+        if "OF" in fl:
+            cc= int(fl["OF"])
+            size= int(fl["SIZE"])
+            cs= int(fl["CS"])
+        else:
+            cc= max(ps)+1
+            if any(i not in ps for i in range(cc)):return None
+            size= sum(ps[i]["size"] for i in range(cc))
+            cs= ps[0]["size"]
+    except(KeyError,ValueError):return None
+    ms=(got["first"]>>22)+DISCORD_EPOCH_MS
+    rec={
+        "file_id": fid,
+        "file_name": got["name"],
+        "chunk_count": cc,
+        "chunk_size": cs,
+        "size": size,
+        "chunks": [ps.get(i) for i in range(cc)],
+        "compression": None,
+        "upload_date": datetime.fromtimestamp(ms/1000).strftime("%Y-%m-%d %H:%M:%S"),
+        "in_process":False
+    }
+    if "PAR" in fl:
+        try:k,m=(int(x) for x in fl["PAR"].split(","))
+        except ValueError:return None
+        rec["parity"]={"k":k,"m":m}
+        rec["parity_chunks"]=[ps.get(cc+j) for j in range(parity_count(rec))]
+    return rec if recoverable(rec) else None
+
+def recoverable(rec):
+    if all(rec["chunks"]):return True
+    par= rec.get("parity")
+    if not par:return False
+    cc= rec["chunk_count"]
+    k,m= par["k"],par["m"]
+    for sn,s0 in enumerate(range(0,cc,k)):
+        kk= min(k,cc-s0)
+        have= sum(1 for e in rec["chunks"][s0:s0+kk] if e)+sum(1 for e in rec["parity_chunks"][sn*m:sn*m+m] if e)
+        if have<kk:return False
+    return True
+
+def manifest_channel(cfg):
+    return cfg.get("manifest_channel_id") or cfg["channel_id"]
+
+def manifest_record(f):
+    r= dict(f)
+    for k in("source_path","source_mtime","in_process"):r.pop(k,None)
+    return r
+
+def note_manifest(cfg,op):
+    if not cfg.get("manifest",True):return
+    with db_lock,db_conn:
+        db_conn.execute("INSERT INTO manifest_ops(op) VALUES(?)",(json.dumps(op),))
+    manifest_wake.set()
+
+def wait_unless_stopped(secs):
+    t= time.time()+secs
+    while not STOP_WORKERS and time.time()<t:time.sleep(0.2)
+
+def manifest_publisher(cfg):
+    fails=0
+    while not STOP_WORKERS:
+        manifest_wake.clear()
+        if flush_manifest(cfg)is False:
+            fails+=1
+            wait_unless_stopped(backoff_delay(min(fails,8)))
+        else:
+            fails=0
+            manifest_wake.wait(1)
+    flush_manifest(cfg)
+
+def start_manifest(cfg):
+    global manifest_thread
+    manifest_thread= threading.Thread(target=manifest_publisher,args=(cfg,),daemon=True)
+    manifest_thread.start()
+
+def post_manifest(cfg,kind,payload):
+    ch= manifest_channel(cfg)
+    url=f"{API_BASE}/channels/{ch}/messages"
+    body= zlib.compress(json.dumps(payload,separators=(",",":")).encode())
+    mb= MultipartBody({"content":f"DRIVECORD:{kind}"},[(f"{kind.lower()}.json.z",body)])
+    for n in range(cfg.get("chunk_retries",CHUNK_RETRIES)+1):
+        try:
+            r,_=discord_request(cfg["bot_tokens"],"POST",url,f"POST /channels/{ch}/messages",data=mb,headers={"Content-Type":mb.content_type})
+            if r.status_code in(200,201):return r.json()
+        except:pass
+        if STOP_WORKERS:break
+        wait_unless_stopped(backoff_delay(n))
+    return None
+
+def flush_manifest(cfg):
+    if not cfg.get("manifest",True) or not cfg["bot_tokens"]:return None
+    with db_lock:
+        rows= db_conn.execute("SELECT seq,op FROM manifest_ops ORDER BY seq").fetchall()
+    if not rows:return None
+    if not post_manifest(cfg,"DELTA",{"ops":[json.loads(op) for _,op in rows]}):return False
+    with db_lock,db_conn:
+        db_conn.execute("DELETE FROM manifest_ops WHERE seq<=?",(rows[-1][0],))
+    cfg["manifest_deltas"]= cfg.get("manifest_deltas",0)+len(rows)
+    if cfg["manifest_deltas"]>= cfg.get("manifest_snapshot_every",MANIFEST_SNAPSHOT_EVERY):
+        publish_snapshot(cfg)
+    save_config(cfg,("manifest_deltas","manifest_pin"))
+    return True
+
+def publish_snapshot(cfg):
+    dirs=[]
+    files=[]
+    def dfs(d,path):
+        dirs.append(path)
+        for f in list(d["files"]):
+            if not f.get("in_process"):files.append([path,manifest_record(f)])
+        for sb in list(d["subdirs"]):
+            dfs(sb,path+"/"+sb["name"])
+    dfs(cfg["directories"],"root")
+    msg= post_manifest(cfg,"SNAPSHOT",{"dirs":dirs,"files":files})
+    if not msg:return
+    cfg["manifest_deltas"]=0
+    ch= manifest_channel(cfg)
+    tokens= cfg["bot_tokens"]
+    old= cfg.get("manifest_pin")
+    try:
+        r,_=discord_request(tokens,"PUT",f"{API_BASE}/channels/{ch}/pins/{msg['id']}",f"PUT /channels/{ch}/pins/:id")
+        if r.status_code==204:
+            cfg["manifest_pin"]= msg["id"]
+            if old:discord_request(tokens,"DELETE",f"{API_BASE}/channels/{ch}/pins/{old}",f"DELETE /channels/{ch}/pins/:id")
+    except:pass
+
+def fetch_pins(token,channel):
+    try:
+        r,_=discord_request(token,"GET",f"{API_BASE}/channels/{channel}/pins",f"GET /channels/{channel}/pins")
+        if r.status_code==200:return r.json()
+    except:pass
+    return[]
+
+def queue_restore(cfg):
+    tid= register_task("restore",{
+        "type":"restore",
+        "progress":0,
+        "total":0,
+        "status":"Looking for manifest...",
+        "finished":False
+    })
+    th= threading.Thread(target=restore_manifest,args=(tid,cfg),daemon=True)
+    th.start()
+
+def restore_manifest(tid,cfg):
+    tokens= cfg["bot_tokens"]
+    if not tokens:
+        with active_tasks_lock:active_tasks[tid]["status"]="No tokens"
+        finish_task(tid)
+        return
+    ch= manifest_channel(cfg)
+    snaps=[m for m in fetch_pins(tokens[0],ch) if m.get("content")=="DRIVECORD:SNAPSHOT"]
+    snap= max(snaps,key=lambda m:int(m["id"])) if snaps else None
+    deltas=[]
+    if snap:
+        cur= snap["id"]
+        while not STOP_WORKERS:
+            msgs= fetch_msg(tokens[0],ch,100,after=cur)
+            if not msgs:break
+            deltas+=[m for m in msgs if m.get("content")=="DRIVECORD:DELTA"]
+            cur= max(int(m["id"]) for m in msgs)
+            if len(msgs)<100:break
+    else:
+        cur=None
+        while snap is None and not STOP_WORKERS:
+            msgs= fetch_msg(tokens[0],ch,100,before=cur)
+            if not msgs:break
+            for m in sorted(msgs,key=lambda m:-int(m["id"])):
+                if m.get("content")=="DRIVECORD:SNAPSHOT":
+                    snap= m
+                    break
+                if m.get("content")=="DRIVECORD:DELTA":deltas.append(m)
+            cur= min(int(m["id"]) for m in msgs)
+            if len(msgs)<100:break
+    msgs= sorted(([snap] if snap else[])+deltas,key=lambda m:int(m["id"]))
+    with active_tasks_lock:
+        active_tasks[tid]["total"]= len(msgs)
+        active_tasks[tid]["status"]="Downloading manifest..."
+    bodies=[None]*len(msgs)
+    pending=Queue()
+    for i in range(len(msgs)):pending.put(i)
+    def run(tk):
+        while True:
+            try:i= pending.get_nowait()
+            except Empty:return
+            a= msgs[i].get("attachments") or[{}]
+            dd= drive(adl_attach(a[0].get("url",""),tk))
+            try:bodies[i]= json.loads(zlib.decompress(dd))
+            except:pass
+            with active_tasks_lock:active_tasks[tid]["progress"]+=1
+            notify_progress()
+    ths=[threading.Thread(target=run,args=(tk,),daemon=True) for tk in tokens]
+    for th in ths:th.start()
+    for th in ths:th.join()
+    if any(b is None for b in bodies):
+        with active_tasks_lock:active_tasks[tid]["status"]="Manifest download failed"
+        finish_task(tid)
+        notify_progress()
+        return
+    dirs=set()
+    state={}
+    for m,b in zip(msgs,bodies):
+        if m is snap:
+            dirs=set(b["dirs"])
+            state={r["file_id"]:(p,r) for p,r in b["files"]}
+            continue
+        for op in b["ops"]:
+            if op["op"]=="put":
+                state[op["record"]["file_id"]]=(op["path"],op["record"])
+                dirs.add(op["path"])
+            elif op["op"]=="del":state.pop(op["file_id"],None)
+            elif op["op"]=="move" and op["file_id"] in state:
+                state[op["file_id"]]=(op["path"],state[op["file_id"]][1])
+                dirs.add(op["path"])
+            elif op["op"]=="rmdir":
+                sub= op["path"]+"/"
+                dirs={d for d in dirs if d!=op["path"] and not d.startswith(sub)}
+                state={k:v for k,v in state.items() if v[0]!=op["path"] and not v[0].startswith(sub)}
+    for d in sorted(dirs):ensure_dir(cfg,d.split("/"))
+    added=0
+    for fid,(path,rec) in state.items():
+        if fid in file_index:continue
+        rec["in_process"]=False
+        ents=[(i,e) for i,e in enumerate((rec.get("chunks") or[])+(rec.get("parity_chunks") or[])) if e]
+        add_file_record(cfg,path.split("/"),rec)
+        db_put_chunks(fid,ents)
+        added+=1
+    with active_tasks_lock:
+        active_tasks[tid]["status"]= f"Restore done: {added} files from {len(msgs)} manifest messages"
+    finish_task(tid)
+    notify_progress()
 
 def ask_input(stdscr,title,prompt,init="",color_pair=0):
     curses.curs_set(1)
@@ -371,6 +1931,23 @@ def confirm_delete_file(stdscr,name):
         if c in [ord('y'),ord('Y')]: return True
         if c in [ord('n'),ord('N')]: return False
 
+def confirm_cancel(stdscr):
+    txt="Cancel this transfer? Partial uploads are removed. (y/n)"
+    curses.curs_set(0)
+    h,w= stdscr.getmaxyx()
+    bw=80
+    bh=5
+    yy=(h-bh)//2
+    xx=(w-bw)//2
+    wn= curses.newwin(bh,bw,yy,xx)
+    wn.box()
+    safe_addstr(wn,2,2,txt,curses.color_pair(1))
+    wn.refresh()
+    while True:
+        c= wn.getch()
+        if c in [ord('y'),ord('Y')]: return True
+        if c in [ord('n'),ord('N')]: return False
+
 def confirm_delete_dir(stdscr,name):
     txt= f"Delete directory '{name}'? (y/n)"
     curses.curs_set(0)
@@ -452,26 +2029,79 @@ def draw_tree(stdscr,arr,sel,top):
         used=y
     return used+1
 
+def metric_lines():
+    snap= metrics_snapshot()
+    lines=[]
+    for(op,tk,ch),v in sorted(snap.items(),key=lambda x:(x[0][1],x[0][0],x[0][2])):
+        p50= metric_quantile(v,0.5)
+        p99= metric_quantile(v,0.99)
+        lat= f"p50<={p50}s p99<={p99}s" if p50 is not None else""
+        mb= f"{v['bytes']/1048576:.1f} MB" if v["bytes"] else""
+        lines.append(f"{tk:<8} {op:<30} {ch:<20} n={v['count']:<6} err={v['errors']:<4} {lat} {mb}")
+    return lines
+
+def draw_metrics(stdscr,top):
+    h,w= stdscr.getmaxyx()
+    lines= metric_lines()
+    safe_addstr(stdscr,11,4,f"{'token':<8} {'operation':<30} {'channel':<20} counts, latency buckets, bytes",curses.color_pair(5))
+    row=12
+    for ln in lines[top:top+max(1,h-14)]:
+        safe_addstr(stdscr,row,4,ln,curses.color_pair(6))
+        row+=1
+    if not lines:safe_addstr(stdscr,row,4,"No requests yet",curses.color_pair(6))
+    return len(lines)
+
+def transfer_list():
+    evict_tasks()
+    with active_tasks_lock:
+        return[(tid,t) for tid,t in active_tasks.items() if t["type"] in("file_upload","download") and not(t["type"]=="download" and t["finished"])]
+
+def transfer_line(tid,t):
+    pg= t.get("progress",0)
+    tot= t.get("total",0)
+    pc= int(pg/tot*100) if tot>0 else 0
+    name= os.path.basename(t["filepath"]) if t["type"]=="file_upload" else f"ID={t['file_id']}"
+    flags= PRIO_NAMES[t.get("priority",PRIO_BULK)]
+    if tasks_queue.paused(tid):flags+=",paused"
+    return f"{'UP' if t['type']=='file_upload' else 'DOWN':<4} {name} => {pg}/{tot} {pc}% [{flags}] {t['status']} {task_rate(t)}"
+
+def draw_transfers(stdscr,arr,sel):
+    h,w= stdscr.getmaxyx()
+    top= max(0,sel-(h-14))
+    row=12
+    for i,(tid,t) in enumerate(arr[top:top+max(1,h-13)]):
+        line= f"{'>' if top+i==sel else ' '} {transfer_line(tid,t)}"
+        safe_addstr(stdscr,row,2,line,curses.color_pair(4) if top+i==sel else curses.color_pair(6))
+        row+=1
+    if not arr:safe_addstr(stdscr,row,4,"No transfers",curses.color_pair(6))
+
 def show_active_tasks(stdscr,used):
+    evict_tasks()
+    h,w= stdscr.getmaxyx()
     with active_tasks_lock:
-        tasks_list= list(active_tasks.values())
+        tasks_list= list(itertools.islice(live_tasks.values(),max(0,h-used-4)))
     row= used+2
-    text_label="[Active Uploads/Downloads] Press R to refresh"
+    text_label="[Active Uploads/Downloads]"
     safe_addstr(stdscr,row,4,text_label,curses.color_pair(5))
     row+=1
     for t in tasks_list:
-        if t.get("finished"): continue
         ty= t["type"].upper()
         st= t["status"]
         pg= t.get("progress",0)
         tot= t.get("total",0)
         pc= int(pg/tot*100) if tot>0 else 0
+        rt= task_rate(t)
+        if rt:st=f"{st} {rt}"
         if ty=="FILE_UPLOAD":
             fn= os.path.basename(t["filepath"])
             line= f"UPLOAD: {fn} => {pg}/{tot} {pc}% {st}"
         elif ty=="DOWNLOAD":
             fid= t["file_id"]
             line= f"DOWNLOAD: ID={fid} => {pg}/{tot} {pc}% {st}"
+        elif ty=="REBUILD":
+            line= f"REBUILD: ranges {pg}/{tot} {st}"
+        elif ty=="RESTORE":
+            line= f"RESTORE: {pg}/{tot} {st}"
         else:
             continue
         row+=1
@@ -479,89 +2109,275 @@ def show_active_tasks(stdscr,used):
 
 def upload_file_menu(stdscr,cfg):
     curses.curs_set(1)
-    fp= ask_input(stdscr,"Upload","Enter file path:","",curses.color_pair(1))
+    fp= ask_input(stdscr,"Upload","Enter file or directory path:","",curses.color_pair(1))
     if not fp: return
-    if not os.path.isfile(fp):
+    if not os.path.exists(fp):
         error_popup(stdscr,"File does not exist","Error",1)
         return
     dd= ask_input(stdscr,"Directory","Enter directory path:","root",curses.color_pair(1))
-    if not dd.strip(): dd="root"
-    sp= [x for x in dd.split("/") if x.strip()]
-    if not sp or sp[0].lower()!="root": sp=["root"]+sp
-    queue_upload(cfg,fp,sp)
+    sp= dir_path_list(dd)
+    if os.path.isdir(fp):queue_upload_dir(cfg,fp,sp)
+    else:queue_upload(cfg,fp,sp)
+
+def queue_upload_dir(cfg,dp,pl):
+    thr= cfg.get("pack_threshold_kb",PACK_THRESHOLD_KB)*1024
+    pack= cfg.get("pack_small_files",True)
+    top= os.path.basename(os.path.abspath(dp))
+    small=[]
+    for base,dirs,files in os.walk(dp):
+        dirs.sort()
+        rel= os.path.relpath(base,dp)
+        sub= pl+[top]+([] if rel=="." else rel.split(os.sep))
+        if not files:ensure_dir(cfg,sub)
+        for fn in sorted(files):
+            fp= os.path.join(base,fn)
+            if not os.path.isfile(fp):continue
+            if pack and os.path.getsize(fp)<thr:small.append((fp,sub))
+            else:queue_upload(cfg,fp,sub)
+    if small:queue_pack_upload(cfg,small)
+
+def queue_pack_upload(cfg,items):
+    recs=[]
+    for fp,pl in items:
+        sz= os.path.getsize(fp)
+        fobj={
+            "file_id": generate_fid(),
+            "file_name": os.path.basename(fp),
+            "chunk_count": 1,
+            "chunk_size": CHUNK_SIZE,
+            "size": sz,
+            "chunks": [None],
+            "source_path": os.path.abspath(fp),
+            "source_mtime": int(os.path.getmtime(fp)),
+            "compression": None,
+            "pack": {"id":None,"offset":0,"length":sz},
+            "upload_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "in_process":True
+        }
+        add_file_record(cfg,pl,fobj)
+        recs.append(fobj)
+    start_pack_upload(cfg,recs)
+
+def start_pack_upload(cfg,recs):
+    cs= CHUNK_SIZE
+    packs=[]
+    cur=[]
+    used=0
+    for r in recs:
+        if cur and used+r["size"]>cs:
+            packs.append(cur)
+            cur=[]
+            used=0
+        cur.append(r)
+        used+= r["size"]
+    if cur:packs.append(cur)
+    comp=None
+    if cfg.get("compression","none")!="none":
+        comp={"codec":cfg["compression"],"level":cfg.get("compression_level",6)}
+    jobs=[]
+    for members in packs:
+        pid= generate_fid()
+        off=0
+        for r in members:
+            r["pack"]={"id":pid,"offset":off,"length":r["size"]}
+            r["compression"]= comp
+            off+= r["size"]
+            db_update_file(r)
+        tid= register_task("packtask",{
+            "type":"file_upload",
+            "priority":PRIO_BULK,
+            "filepath": f"{len(members)} small files",
+            "file_id": pid,
+            "progress":0,
+            "total":1,
+            "started":time.time(),
+            "bytes":0,
+            "bytes_base":0,
+            "bytes_total":off,
+            "record": None,
+            "members": members,
+            "chunk_state": bytearray(1),
+            "status":"Uploading...",
+            "finished":False
+        })
+        jobs.append((tid,pid,members))
+    window= threading.Semaphore(upload_window(cfg))
+    th= threading.Thread(target=pack_reader,args=(cfg,jobs,comp,window),daemon=True)
+    with active_tasks_lock:
+        for tid,_,_ in jobs:active_tasks[tid]["reader"]= th
+    th.start()
+
+def pack_reader(cfg,jobs,comp,window):
+    for tid,pid,members in jobs:
+        if tasks_queue.cancelled(tid):continue
+        while not window.acquire(timeout=0.5):
+            if STOP_WORKERS:return
+        parts=[]
+        try:
+            for r in members:
+                with open(r["source_path"],"rb")as f:
+                    dd= f.read(r["size"]+1)
+                if len(dd)!=r["size"]:raise OSError(f"{r['file_name']} changed during upload")
+                parts.append(dd)
+        except OSError as e:
+            window.release()
+            with active_tasks_lock:active_tasks[tid]["status"]=f"Read error: {e}"
+            finish_task(tid)
+            notify_progress()
+            continue
+        dd= b"".join(parts)
+        parts=None
+        meta= f"OF:1 SIZE:{len(dd)} CS:{len(dd)}"
+        enqueue_chunks(tid,pid,f"pack_{pid}",[{"idx":0,"data":dd,"hash":hashlib.sha256(dd).hexdigest()}],comp,window,meta)
 
 def queue_upload(cfg,fp,pl):
     if not os.path.isfile(fp): return
     sz= os.path.getsize(fp)
     cc=1
     if sz>0:
-        cc= max(1, math.ceil(sz/(cfg["chunk_size_mb"]*1024*1024)))
+        cc= max(1, math.ceil(sz/CHUNK_SIZE))
     fid= generate_fid()
     fn= os.path.basename(fp)
-    root= cfg["directories"]
-    c= root
-    for nm in pl[1:]:
-        sb= find_subdir(c,nm)
-        if not sb:
-            sb={"name":nm,"files":[],"subdirs":[],"expanded":False}
-            c["subdirs"].append(sb)
-        c= sb
     fobj={
         "file_id": fid,
         "file_name": fn,
         "chunk_count": cc,
+        "chunk_size": CHUNK_SIZE,
+        "size": sz,
+        "chunks": [None]*cc,
+        "source_path": os.path.abspath(fp),
+        "source_mtime": int(os.path.getmtime(fp)),
+        "compression": None,
         "upload_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "in_process":True
     }
-    c["files"].append(fobj)
-    save_config(cfg)
-    tid="filetask_"+str(random.randint(10000,99999))
-    with active_tasks_lock:
-        active_tasks[tid]={
-            "type":"file_upload",
-            "filepath": fp,
-            "file_id": fid,
-            "progress":0,
-            "total":cc,
-            "status":"Uploading...",
-            "finished":False
-        }
-    tokens= cfg["bot_tokens"]
-    if not tokens:tokens=["NO_TOKENS"]
-    i=0
-    chunk_sz= cfg["chunk_size_mb"]*1024*1024
-    def chunker():
-        with open(fp,"rb")as f:
-            idx=0
-            while True:
-                dd= f.read(chunk_sz)
-                if not dd:break
-                yield(idx,dd)
-                idx+=1
-    for idx,data in chunker():
-        cid= "chunk_"+str(random.randint(10000,99999))
-        tk= tokens[i%len(tokens)]
-        i+=1
+    if cfg.get("compression","none")!="none":
+        fobj["compression"]={"codec":cfg["compression"],"level":cfg.get("compression_level",6)}
+    if cfg.get("parity_shards",0)>0 and sz>0:
+        fobj["parity"]={"k":cfg.get("parity_data",8),"m":cfg["parity_shards"]}
+        fobj["parity_chunks"]=[None]*parity_count(fobj)
+    add_file_record(cfg,pl,fobj)
+    start_upload(cfg,fobj)
+
+def start_upload(cfg,fobj):
+    fp= fobj["source_path"]
+    fid= fobj["file_id"]
+    pieces= fobj["chunks"]+fobj.get("parity_chunks",[])
+    landed= sum(1 for x in pieces if x)
+    base= min(fobj.get("size",0),sum(1 for x in fobj["chunks"] if x)*fobj["chunk_size"])
+    tid= register_task("filetask",{
+        "type":"file_upload",
+        "priority":PRIO_BULK,
+        "filepath": fp,
+        "file_id": fid,
+        "progress":landed,
+        "total":len(pieces),
+        "started":time.time(),
+        "bytes":base,
+        "bytes_base":base,
+        "bytes_total":fobj.get("size",0)+len(pieces[fobj["chunk_count"]:])*fobj["chunk_size"],
+        "record": fobj,
+        "chunk_state": bytearray(CHUNK_DONE if x else 0 for x in pieces),
+        "status":"Resuming..." if landed else"Uploading...",
+        "finished":False
+    })
+    if landed==len(pieces):
+        with active_tasks_lock:active_tasks[tid]["status"]="Upload complete"
+        finalize_upload(cfg,fid)
+        finish_task(tid)
+        return
+    window= threading.Semaphore(upload_window(cfg,1 if fobj.get("parity") else attachments_per_message(cfg,fobj["chunk_size"])))
+    th= threading.Thread(target=upload_reader,args=(cfg,tid,fobj,window),daemon=True)
+    with active_tasks_lock:active_tasks[tid]["reader"]= th
+    th.start()
+
+def resume_uploads(cfg):
+    packed=[]
+    def dfs(d):
+        for f in d["files"]:
+            if not f.get("in_process",False):continue
+            if f.get("pack"):packed.append(f)
+            else:start_upload(cfg,f)
+        for sb in d["subdirs"]:
+            dfs(sb)
+    dfs(cfg["directories"])
+    if packed:start_pack_upload(cfg,packed)
+
+def upload_window(cfg,group=1):
+    per= cfg.get("upload_window_per_token",UPLOAD_WINDOW_PER_TOKEN)
+    return max(1,per*max(1,len(cfg["bot_tokens"])))*group
+
+def read_chunk(f,off,n,fn):
+    buf= bytearray(n)
+    f.seek(off)
+    if f.readinto(buf)<n:raise OSError(f"{fn} changed during upload")
+    return buf
+
+def upload_reader(cfg,tid,fobj,window):
+    fid= fobj["file_id"]
+    fn= fobj["file_name"]
+    chunk_sz= fobj["chunk_size"]
+    comp= fobj.get("compression")
+    cc= fobj["chunk_count"]
+    par= fobj.get("parity")
+    k= par["k"] if par else cc
+    group= 1 if par else attachments_per_message(cfg,chunk_sz)
+    meta= caption_meta(fobj)
+    batch=[]
+    refs=[]
+    def send(idx,dd):
+        h= hashlib.sha256(dd).hexdigest()
+        known= db_get_hash(h) if cfg.get("dedup",True) and not par else None
+        if known:
+            known["hash"]= h
+            refs.append({"idx":idx,"ent":known,"size":len(dd)})
+            window.release()
+            if len(refs)>=REFS_PER_MESSAGE:
+                enqueue_refs(tid,fid,fn,refs[:],meta)
+                refs.clear()
+            return
+        batch.append({"idx":idx,"data":dd,"hash":h})
+        if len(batch)>=group:
+            enqueue_chunks(tid,fid,fn,batch[:],comp,window,meta)
+            batch.clear()
+    try:
+        with open(fobj["source_path"],"rb")as f:
+            for s0 in range(0,cc,k):
+                if tasks_queue.cancelled(tid):return
+                kk= min(k,cc-s0)
+                pidx=[cc+s0//k*par["m"]+j for j in range(par["m"])] if par else[]
+                need=[p for p in pidx if not fobj["parity_chunks"][p-cc]]
+                acc=[0]*len(pidx)
+                ln=0
+                for idx in range(s0,s0+kk):
+                    if fobj["chunks"][idx] and not need:continue
+                    up= not fobj["chunks"][idx]
+                    if up:
+                        while not window.acquire(timeout=0.5):
+                            if STOP_WORKERS or tasks_queue.cancelled(tid):return
+                    dd= read_chunk(f,idx*chunk_sz,min(chunk_sz,fobj["size"]-idx*chunk_sz),fn)
+                    if need:
+                        ln= max(ln,len(dd))
+                        pd= bytes(dd).ljust(ln,b"\0")
+                        rs_add(acc,k,idx-s0,pd)
+                    if up:send(idx,dd)
+                for p in need:
+                    while not window.acquire(timeout=0.5):
+                        if STOP_WORKERS or tasks_queue.cancelled(tid):return
+                    send(p,acc[p-pidx[0]].to_bytes(ln,"little"))
+                acc=None
+            if batch:enqueue_chunks(tid,fid,fn,batch,comp,window,meta)
+            if refs:enqueue_refs(tid,fid,fn,refs,meta)
+    except (OSError,ValueError) as e:
         with active_tasks_lock:
-            active_tasks[cid]={
-                "type":"chunk_upload",
-                "file_id": fid,
-                "chunk_idx": idx,
-                "chunk_data": data,
-                "part_filename": f"{fn}.part{idx}",
-                "file_task_id": tid,
-                "status":"pending",
-                "finished":False,
-                "token": tk
-            }
-        tasks_queue.put((cid,active_tasks[cid]))
+            active_tasks[tid]["status"]=f"Read error: {e}"
+        finish_task(tid)
+        notify_progress()
 
 def move_file_prompt(stdscr,cfg,fid):
     dd= ask_input(stdscr,"Move File","Enter new directory path:","root",curses.color_pair(1))
     if not dd.strip():return
-    sp=[x for x in dd.split("/") if x.strip()]
-    if not sp or sp[0].lower()!="root": sp=["root"]+sp
-    move_file_record(cfg,fid,sp)
+    move_file_record(cfg,fid,dir_path_list(dd))
 
 def main_loop(stdscr,cfg):
     screen="main_menu"
@@ -569,22 +2385,37 @@ def main_loop(stdscr,cfg):
     tree_sel=0
     tree_top=0
     set_sel=0
+    met_top=0
+    met_n=0
+    xfer_sel=0
+    frame= 1.0/UI_MAX_FPS
+    stdscr.timeout(int(frame*1000))
+    dirty=True
+    last=0.0
     while True:
-        stdscr.clear()
-        do_banner(stdscr)
+        if progress_event.is_set() and time.time()-last>=frame:
+            progress_event.clear()
+            dirty=True
+        if dirty:
+            stdscr.erase()
+            do_banner(stdscr)
         if screen=="main_menu":
-            items=["Browse Files","Upload File","Settings","Quit"]
-            base=11
-            for i,v in enumerate(items):
-                arrow=">" if i==sel else" "
-                if i==sel:
-                    safe_addstr(stdscr,base+i,4,f"{arrow} {v}",curses.color_pair(2))
-                else:
-                    safe_addstr(stdscr,base+i,4,f"  {v}")
-            used= base+ len(items)
-            show_active_tasks(stdscr,used)
-            stdscr.refresh()
+            items=["Browse Files","Upload File","Transfers","Metrics","Settings","Quit"]
+            if dirty:
+                base=11
+                for i,v in enumerate(items):
+                    arrow=">" if i==sel else" "
+                    if i==sel:
+                        safe_addstr(stdscr,base+i,4,f"{arrow} {v}",curses.color_pair(2))
+                    else:
+                        safe_addstr(stdscr,base+i,4,f"  {v}")
+                used= base+ len(items)
+                show_active_tasks(stdscr,used)
+                stdscr.noutrefresh()
+                curses.doupdate()
+                last=time.time()
             c= stdscr.getch()
+            dirty= c!=-1
             if c==-1: pass
             elif c in[ord('r'),ord('R')]:
                 pass
@@ -596,16 +2427,23 @@ def main_loop(stdscr,cfg):
                 choice= items[sel]
                 if choice=="Browse Files": screen="tree"; tree_sel=0; tree_top=0
                 elif choice=="Upload File": upload_file_menu(stdscr,cfg)
+                elif choice=="Transfers": screen="transfers"; xfer_sel=0
+                elif choice=="Metrics": screen="metrics"; met_top=0
                 elif choice=="Settings": screen="settings"; set_sel=0
                 elif choice=="Quit": return
         elif screen=="tree":
             arr= build_tree_lines(cfg["directories"],"",True)
-            note="(Up/Down, PgUp/PgDn, Left/Right, Enter=Download, D=rmFile, X=rmDir, M=moveFile, ESC=menu)"
-            safe_addstr(stdscr,10,max(0,(stdscr.getmaxyx()[1]-len(note))//2),note,curses.color_pair(2))
-            used= draw_tree(stdscr,arr,tree_sel,tree_top)
-            show_active_tasks(stdscr,used)
-            stdscr.refresh()
+            if tree_sel>=len(arr):tree_sel=max(0,len(arr)-1)
+            if dirty:
+                note="(Up/Down, PgUp/PgDn, Left/Right, Enter=Download, D=rmFile, X=rmDir, M=moveFile, ESC=menu)"
+                safe_addstr(stdscr,10,max(0,(stdscr.getmaxyx()[1]-len(note))//2),note,curses.color_pair(2))
+                used= draw_tree(stdscr,arr,tree_sel,tree_top)
+                show_active_tasks(stdscr,used)
+                stdscr.noutrefresh()
+                curses.doupdate()
+                last=time.time()
             c= stdscr.getch()
+            dirty= c!=-1
             if c==-1: pass
             elif c in[ord('r'),ord('R')]:
                 pass
@@ -626,12 +2464,12 @@ def main_loop(stdscr,cfg):
                 if arr:
                     ln,ty,node= arr[tree_sel]
                     if ty=="dir" and node.get("expanded",False):
-                        node["expanded"]=False
+                        set_expanded(cfg,node,False)
             elif c== curses.KEY_RIGHT:
                 if arr:
                     ln,ty,node= arr[tree_sel]
                     if ty=="dir" and not node.get("expanded",False):
-                        node["expanded"]=True
+                        set_expanded(cfg,node,True)
             elif c in[10,13]:
                 if arr:
                     ln,ty,node= arr[tree_sel]
@@ -648,7 +2486,7 @@ def main_loop(stdscr,cfg):
                     if ty=="dir":
                         if node["name"]!="root":
                             if confirm_delete_dir(stdscr,node["name"]):
-                                delete_dir(cfg,node["name"])
+                                delete_dir(cfg,dir_path_of(cfg,node))
             elif c in[ord('m'),ord('M')]:
                 if arr:
                     ln,ty,node= arr[tree_sel]
@@ -656,27 +2494,68 @@ def main_loop(stdscr,cfg):
                         move_file_prompt(stdscr,cfg,node["file_id"])
             elif c==27:
                 screen="main_menu"
+        elif screen=="transfers":
+            arr= transfer_list()
+            if xfer_sel>=len(arr):xfer_sel=max(0,len(arr)-1)
+            if dirty:
+                note="(Up/Down, P=pause/resume, C=cancel, +/-=priority, ESC=menu)"
+                safe_addstr(stdscr,10,max(0,(stdscr.getmaxyx()[1]-len(note))//2),note,curses.color_pair(2))
+                draw_transfers(stdscr,arr,xfer_sel)
+                stdscr.noutrefresh()
+                curses.doupdate()
+                last=time.time()
+            c= stdscr.getch()
+            dirty= c!=-1
+            if c== curses.KEY_UP:xfer_sel= max(0,xfer_sel-1)
+            elif c== curses.KEY_DOWN:xfer_sel= min(max(0,len(arr)-1),xfer_sel+1)
+            elif c==27:screen="main_menu"
+            elif arr and c in[ord('p'),ord('P')]:toggle_pause(arr[xfer_sel][0])
+            elif arr and c in[ord('c'),ord('C')]:
+                if confirm_cancel(stdscr):cancel_task(cfg,arr[xfer_sel][0])
+            elif arr and c in[ord('+'),ord('=')]:shift_priority(arr[xfer_sel][0],-1)
+            elif arr and c in[ord('-'),ord('_')]:shift_priority(arr[xfer_sel][0],1)
+        elif screen=="metrics":
+            if dirty:
+                note="(Up/Down scroll, ESC=menu)"
+                safe_addstr(stdscr,10,max(0,(stdscr.getmaxyx()[1]-len(note))//2),note,curses.color_pair(2))
+                met_n= draw_metrics(stdscr,met_top)
+                stdscr.noutrefresh()
+                curses.doupdate()
+                last=time.time()
+            c= stdscr.getch()
+            dirty= c!=-1
+            if c== curses.KEY_UP:met_top= max(0,met_top-1)
+            elif c== curses.KEY_DOWN:met_top= min(max(0,met_n-1),met_top+1)
+            elif c==27:screen="main_menu"
         elif screen=="settings":
-            items=["Set Server ID","Set Channel ID","Add Bot Token","Remove Bot Token","List Bot Tokens","Set Chunk Size","Back"]
-            s1= f"Server ID  : {cfg['server_id']}"
-            s2= f"Channel ID : {cfg['channel_id']}"
-            s3= f"Bot Tokens : {len(cfg['bot_tokens'])}"
-            s4= f"Chunk Size : {cfg.get('chunk_size_mb',5)} MB"
-            safe_addstr(stdscr,11,4,s1,curses.color_pair(6))
-            safe_addstr(stdscr,12,4,s2,curses.color_pair(6))
-            safe_addstr(stdscr,13,4,s3,curses.color_pair(6))
-            safe_addstr(stdscr,14,4,s4,curses.color_pair(6))
-            base=16
-            for i,v in enumerate(items):
-                arrow=">" if i==set_sel else" "
-                if i==set_sel:
-                    safe_addstr(stdscr,base+i,4,f"{arrow} {v}",curses.color_pair(2))
-                else:
-                    safe_addstr(stdscr,base+i,4,f"  {v}")
-            used= base+ len(items)
-            show_active_tasks(stdscr,used)
-            stdscr.refresh()
+            items=["Set Server ID","Set Channel ID","Set Storage Channels","Add Bot Token","Remove Bot Token","List Bot Tokens","Set Chunk Size","Set Compression","Set Parity","Rebuild Index","Restore From Manifest","Back"]
+            if dirty:
+                s1= f"Server ID  : {cfg['server_id']}"
+                s2= f"Channel ID : {cfg['channel_id']} ({len(storage_channels(cfg))} storage)"
+                s3= f"Bot Tokens : {len(cfg['bot_tokens'])}"
+                s4= f"Chunk Size : {cfg.get('chunk_size_mb',5)} MB"
+                safe_addstr(stdscr,11,4,s1,curses.color_pair(6))
+                safe_addstr(stdscr,12,4,s2,curses.color_pair(6))
+                safe_addstr(stdscr,13,4,s3,curses.color_pair(6))
+                s5= f"Compression: {cfg.get('compression','none')} {cfg.get('compression_level',6)}"
+                safe_addstr(stdscr,14,4,s4,curses.color_pair(6))
+                s6= f"Parity     : {cfg.get('parity_shards',0)} per {cfg.get('parity_data',8)} chunks"
+                safe_addstr(stdscr,15,4,s5,curses.color_pair(6))
+                safe_addstr(stdscr,16,4,s6,curses.color_pair(6))
+                base=18
+                for i,v in enumerate(items):
+                    arrow=">" if i==set_sel else" "
+                    if i==set_sel:
+                        safe_addstr(stdscr,base+i,4,f"{arrow} {v}",curses.color_pair(2))
+                    else:
+                        safe_addstr(stdscr,base+i,4,f"  {v}")
+                used= base+ len(items)
+                show_active_tasks(stdscr,used)
+                stdscr.noutrefresh()
+                curses.doupdate()
+                last=time.time()
             c= stdscr.getch()
+            dirty= c!=-1
             if c==-1: pass
             elif c in[ord('r'),ord('R')]:
                 pass
@@ -696,6 +2575,9 @@ def main_loop(stdscr,cfg):
                     if newc:
                         cfg["channel_id"]= newc
                         save_config(cfg)
+                elif choice=="Set Storage Channels":
+                    newv= ask_input(stdscr,"Storage Channels","Channel IDs, comma separated:",",".join(storage_channels(cfg)),curses.color_pair(1))
+                    if newv:set_storage_channels(cfg,newv)
                 elif choice=="Add Bot Token":
                     tok= ask_input(stdscr,"Add Bot Token","Token:","",curses.color_pair(1))
                     if tok:
@@ -727,9 +2609,18 @@ def main_loop(stdscr,cfg):
                 elif choice=="Set Chunk Size":
                     newv= ask_input(stdscr,"Chunk Size","Enter number between 5 and 25:","",curses.color_pair(1))
                     set_chunk_size(cfg,newv)
+                elif choice=="Set Compression":
+                    newv= ask_input(stdscr,"Compression","Codec and level (none / zlib 6 / lzma 6):",f"{cfg.get('compression','none')} {cfg.get('compression_level',6)}",curses.color_pair(1))
+                    if newv:set_compression(cfg,newv)
+                elif choice=="Set Parity":
+                    newv= ask_input(stdscr,"Parity","Data chunks and parity chunks per stripe (8 2; 8 0 = off):",f"{cfg.get('parity_data',8)} {cfg.get('parity_shards',0)}",curses.color_pair(1))
+                    if newv:set_parity(cfg,newv)
+                elif choice=="Rebuild Index":
+                    queue_rebuild(cfg)
+                elif choice=="Restore From Manifest":
+                    queue_restore(cfg)
                 elif choice=="Back":
                     screen="main_menu"
-        time.sleep(0.1)
 
 def big_list_popup(stdscr,msg,title):
     curses.curs_set(0)
@@ -754,18 +2645,288 @@ def big_list_popup(stdscr,msg,title):
     wn.refresh()
     wn.getch()
 
+def drop_task(tid,task):
+    if task["type"]=="chunk_upload":
+        set_chunk_state(task["file_task_id"],[p["idx"] for p in task["parts"]],0)
+        if task.get("window"):
+            for _ in task["parts"]:task["window"].release()
+        task["parts"]=[]
+    elif task["type"]=="chunk_ref":
+        set_chunk_state(task["file_task_id"],[r["idx"] for r in task["refs"]],0)
+    with active_tasks_lock:task["status"]="Cancelled"
+
+def cancel_task(cfg,tid):
+    tasks_queue.cancel(tid)
+    with active_tasks_lock:
+        t= active_tasks.get(tid)
+        if not t:return
+        t["status"]="Cancelled"
+        recs=[t["record"]] if t.get("record") else t.get("members",[])
+    for r in recs:
+        if r.get("in_process"):remove_file_record(cfg,r["file_id"])
+    finish_task(tid)
+    notify_progress()
+
+def toggle_pause(tid):
+    tasks_queue.pause(tid,not tasks_queue.paused(tid))
+    notify_progress()
+
+def shift_priority(tid,d):
+    p= tasks_queue.priority(tid)
+    if p is None:p= PRIO_BULK
+    p= min(len(PRIO_NAMES)-1,max(0,p+d))
+    tasks_queue.set_priority(tid,p)
+    with active_tasks_lock:
+        if tid in active_tasks:active_tasks[tid]["priority"]= p
+    notify_progress()
+
 def worker_loop(cfg):
     while not STOP_WORKERS:
         try:
             tid,task= tasks_queue.get(timeout=0.05)
         except: continue
-        if task["type"]=="chunk_upload":
-            do_chunk_upload(tid,task,cfg)
-        elif task["type"]=="download":
-            do_download(tid,task,cfg)
-        with active_tasks_lock:
-            task["finished"]= True
-        tasks_queue.task_done()
+        run_task(tid,task,cfg)
+
+def run_task(tid,task,cfg):
+    if tasks_queue.cancelled(task.get("file_task_id",tid)):
+        drop_task(tid,task)
+    elif task["type"]=="chunk_upload":
+        do_chunk_upload(tid,task,cfg)
+    elif task["type"]=="chunk_ref":
+        post_refs(tid,task,cfg)
+    elif task["type"]=="download":
+        do_download(tid,task,cfg)
+        tasks_queue.forget(tid)
+    if task["type"]=="download":finish_task(tid)
+    tasks_queue.task_done()
+    notify_progress()
+
+class AsyncResponse:
+    def __init__(self,status,headers,content):
+        self.status_code= status
+        self.headers= headers
+        self.content= content
+
+    @property
+    def text(self):return self.content.decode("utf-8","replace")
+
+    def json(self):return json.loads(self.content)
+
+class AsyncEngine:
+    def __init__(self,cfg,wcount):
+        self.cfg= cfg
+        self.loop= asyncio.new_event_loop()
+        self.thread= threading.Thread(target=self.loop.run_forever,daemon=True)
+        self.pool= ThreadPoolExecutor(max_workers=wcount)
+        self.per_token= max(1,int(cfg.get("async_streams_per_token",ASYNC_STREAMS_PER_TOKEN)))
+        self.limit= max(1,int(cfg.get("async_max_inflight",0)) or self.per_token*max(1,len(cfg["bot_tokens"])))
+        self.slots= asyncio.Semaphore(self.limit)
+        self.sems={}
+        self.idle={}
+        self.running=set()
+        self.ssl= ssl.create_default_context()
+        self.proxies={}
+        self.woken= asyncio.Event()
+        self.stopping= False
+
+    def start(self):
+        self.thread.start()
+        tasks_queue.watchers.append(self.notify)
+        asyncio.run_coroutine_threadsafe(self.dispatch(),self.loop)
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.woken.set)
+
+    def call(self,coro):
+        if self.stopping:
+            coro.close()
+            raise ConnectionError("transfer engine stopped")
+        fut= asyncio.run_coroutine_threadsafe(coro,self.loop)
+        while True:
+            try:return fut.result(timeout=0.5)
+            except FutureTimeout:
+                if fut.done():raise
+                if self.stopping:
+                    fut.cancel()
+                    raise ConnectionError("transfer engine stopped")
+
+    def stop(self):
+        self.stopping= True
+        if self.notify in tasks_queue.watchers:tasks_queue.watchers.remove(self.notify)
+        self.pool.shutdown(wait=False,cancel_futures=True)
+        try:asyncio.run_coroutine_threadsafe(self.close(),self.loop).result(timeout=2)
+        except Exception:pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1)
+
+    async def close(self):
+        me= asyncio.current_task()
+        left=[t for t in asyncio.all_tasks() if t is not me]
+        for t in left:t.cancel()
+        await asyncio.gather(*left,return_exceptions=True)
+        for conns in self.idle.values():
+            for _,wr in conns:wr.close()
+        self.idle.clear()
+
+    async def next_task(self):
+        while not STOP_WORKERS:
+            self.woken.clear()
+            try:return tasks_queue.get(0)
+            except Empty:pass
+            try:await asyncio.wait_for(self.woken.wait(),0.5)
+            except asyncio.TimeoutError:pass
+        return None
+
+    async def dispatch(self):
+        while not STOP_WORKERS:
+            await self.slots.acquire()
+            item= await self.next_task()
+            if item is None:
+                self.slots.release()
+                return
+            t= self.loop.create_task(self.run(*item))
+            self.running.add(t)
+            t.add_done_callback(self.running.discard)
+
+    async def run(self,tid,task):
+        try:
+            if task["type"]=="chunk_upload" and not tasks_queue.cancelled(task["file_task_id"]):
+                try:await achunk_upload(self.cfg,task)
+                finally:
+                    tasks_queue.task_done()
+                    notify_progress()
+            else:await self.loop.run_in_executor(self.pool,run_task,tid,task,self.cfg)
+        finally:self.slots.release()
+
+    def sem(self,tok):
+        s= self.sems.get(tok)
+        if s is None:s= self.sems[tok]= asyncio.Semaphore(self.per_token)
+        return s
+
+    async def connect(self,key):
+        conns= self.idle.get(key)
+        while conns:
+            rd,wr= conns.pop()
+            if not rd.at_eof() and not wr.is_closing():return rd,wr,True
+            wr.close()
+        sc,host,port,px= key
+        if not px:
+            rd,wr= await asyncio.wait_for(asyncio.open_connection(host,port,ssl=self.ssl if sc=="https" else None),HTTP_TIMEOUT[0])
+            return rd,wr,False
+        pu= urlsplit(px)
+        rd,wr= await asyncio.wait_for(asyncio.open_connection(pu.hostname,pu.port or(443 if pu.scheme=="https" else 80),ssl=self.ssl if pu.scheme=="https" else None),HTTP_TIMEOUT[0])
+        if sc=="https":
+            try:await asyncio.wait_for(self.tunnel(rd,wr,px,host,port),HTTP_TIMEOUT[0])
+            except BaseException:
+                wr.close()
+                raise
+        return rd,wr,False
+
+    def proxy_for(self,sc,host):
+        k=(sc,host)
+        if k not in self.proxies:
+            url=f"{sc}://{host}/"
+            self.proxies[k]= requests.utils.select_proxy(url,requests.utils.get_environ_proxies(url))
+        return self.proxies[k]
+
+    def proxy_auth(self,px):
+        user,pw= requests.utils.get_auth_from_url(px)
+        if not user:return{}
+        return{"Proxy-Authorization":"Basic "+base64.b64encode(f"{user}:{pw}".encode()).decode()}
+
+    async def tunnel(self,rd,wr,px,host,port):
+        hd={"Host":f"{host}:{port}",**self.proxy_auth(px)}
+        wr.write((f"CONNECT {host}:{port} HTTP/1.1\r\n"+"".join(f"{k}: {v}\r\n" for k,v in hd.items())+"\r\n").encode("latin-1"))
+        await wr.drain()
+        line= await rd.readline()
+        while(await rd.readline())not in(b"\r\n",b"\n",b""):pass
+        sp= line.split()
+        if len(sp)<2 or sp[1]!=b"200":raise ConnectionError(f"proxy refused CONNECT: {line.decode('latin-1').strip()}")
+        if hasattr(wr,"start_tls"):
+            await wr.start_tls(self.ssl,server_hostname=host)
+            return
+        proto= wr.transport.get_protocol()
+        tr= await self.loop.start_tls(wr.transport,proto,self.ssl,server_hostname=host)
+        wr._transport= rd._transport= tr
+
+    def release(self,key,rd,wr):
+        conns= self.idle.setdefault(key,[])
+        if HTTP_KEEP_ALIVE and len(conns)<max(HTTP_POOL_SIZE,self.limit):conns.append((rd,wr))
+        else:wr.close()
+
+    async def request(self,method,url,headers,body=None):
+        u= urlsplit(url)
+        px= self.proxy_for(u.scheme,u.hostname)
+        key=(u.scheme,u.hostname,u.port or(443 if u.scheme=="https" else 80),px)
+        hd={"Host":u.netloc,"User-Agent":"DriveCord","Accept-Encoding":"identity","Connection":"keep-alive" if HTTP_KEEP_ALIVE else"close",**headers}
+        if body is not None or method in("POST","PUT","PATCH"):hd["Content-Length"]=str(len(body) if body is not None else 0)
+        target= f"{u.path or '/'}{'?'+u.query if u.query else ''}"
+        if px and u.scheme=="http":
+            target= f"http://{u.netloc}{target}"
+            hd.update(self.proxy_auth(px))
+        head= f"{method} {target} HTTP/1.1\r\n"+"".join(f"{k}: {v}\r\n" for k,v in hd.items())+"\r\n"
+        tm= HTTP_TIMEOUT[1]
+        for n in range(2):
+            rd,wr,reused= await self.connect(key)
+            try:
+                wr.write(head.encode("latin-1"))
+                if body is not None:
+                    body.seek(0)
+                    while True:
+                        c= body.read(262144)
+                        if not c:break
+                        wr.write(c)
+                        await asyncio.wait_for(wr.drain(),tm)
+                await asyncio.wait_for(wr.drain(),tm)
+                line= await asyncio.wait_for(rd.readline(),tm)
+                if not line:raise ConnectionResetError("connection closed by server")
+                r,keep= await self.response(rd,line,method,tm)
+            except(OSError,asyncio.IncompleteReadError):
+                wr.close()
+                if reused and n==0:continue
+                raise
+            except BaseException:
+                wr.close()
+                raise
+            if keep:self.release(key,rd,wr)
+            else:wr.close()
+            return r
+
+    async def response(self,rd,line,method,tm):
+        ver,code= line.decode("latin-1").split(None,2)[:2]
+        status= int(code)
+        hd= requests.structures.CaseInsensitiveDict()
+        while True:
+            ln= await asyncio.wait_for(rd.readline(),tm)
+            if ln in(b"\r\n",b"\n",b""):break
+            k,_,v= ln.decode("latin-1").partition(":")
+            hd[k.strip()]= v.strip()
+        keep= ver=="HTTP/1.1" and hd.get("Connection","").lower()!="close"
+        if method=="HEAD" or status in(204,304):body=b""
+        elif "chunked" in hd.get("Transfer-Encoding","").lower():
+            parts=[]
+            while True:
+                sz= int((await asyncio.wait_for(rd.readline(),tm)).split(b";")[0],16)
+                if sz==0:
+                    while(await asyncio.wait_for(rd.readline(),tm))not in(b"\r\n",b"\n",b""):pass
+                    break
+                parts.append(await self.read_exact(rd,sz,tm))
+                await asyncio.wait_for(rd.readexactly(2),tm)
+            body= b"".join(parts)
+        elif "Content-Length" in hd:body= await self.read_exact(rd,int(hd["Content-Length"]),tm)
+        else:
+            body= await asyncio.wait_for(rd.read(),tm)
+            keep= False
+        return AsyncResponse(status,hd,body),keep
+
+    async def read_exact(self,rd,n,tm):
+        parts=[]
+        while n>0:
+            c= await asyncio.wait_for(rd.read(min(n,1048576)),tm)
+            if not c:raise asyncio.IncompleteReadError(b"".join(parts),n)
+            parts.append(c)
+            n-= len(c)
+        return b"".join(parts)
 
 def main(stdscr):
     curses.use_default_colors()
@@ -780,27 +2941,209 @@ def main(stdscr):
     stdscr.nodelay(False)
     cfg= load_config()
     apply_chunk_size(cfg)
+    apply_http_settings(cfg)
     ok,e= valid_ids(cfg["server_id"],cfg["channel_id"])
     if not ok and e:
         error_popup(stdscr,"Warning: "+e,"Startup",1)
+    start_workers(cfg)
     tv= threading.Thread(target=background_token_verifier,args=(cfg,),daemon=True)
     tv.start()
-    wcount=10
-    if len(cfg["bot_tokens"])<10:
-        wcount= len(cfg["bot_tokens"]) if cfg["bot_tokens"] else 1
+    start_metrics(cfg)
+    resume_uploads(cfg)
+    main_loop(stdscr,cfg)
+    stop_workers()
+
+def start_workers(cfg,wcount=None):
+    if not wcount:
+        wcount=10
+        if len(cfg["bot_tokens"])<10:
+            wcount= len(cfg["bot_tokens"]) if cfg["bot_tokens"] else 1
+    start_manifest(cfg)
+    if cfg.get("engine")=="async":
+        global engine
+        engine= AsyncEngine(cfg,wcount)
+        engine.start()
+        return
     for _ in range(wcount):
         th= threading.Thread(target=worker_loop,args=(cfg,),daemon=True)
         th.start()
         worker_threads.append(th)
-    main_loop(stdscr,cfg)
-    global STOP_WORKERS
+
+def stop_workers():
+    global STOP_WORKERS,engine
     STOP_WORKERS= True
+    if manifest_thread:manifest_thread.join(timeout=5)
+    if engine:
+        engine.stop()
+        engine=None
     for th in worker_threads:
         th.join(timeout=1)
-    with active_tasks_lock:
-        for k,v in list(active_tasks.items()):
-            if v.get("type")=="file_upload"and not v.get("finished",False):
-                remove_file_record(cfg,v["file_id"])
+
+def resolve_file(arg):
+    if arg in file_index:return arg
+    dp,_,nm= "/".join(dir_path_list(arg)).rpartition("/")
+    d= dir_index.get(dp)
+    for f in(d["files"] if d else[]):
+        if f["file_name"]==nm:return f["file_id"]
+    return None
+
+def task_idle(tid,t):
+    if t["type"]=="download":return t["finished"]
+    if t.get("reader") and t["reader"].is_alive():return False
+    cs= t.get("chunk_state") or b""
+    return CHUNK_QUEUED not in cs and CHUNK_SENDING not in cs
+
+def emit(obj):
+    sys.stdout.write(json.dumps(obj)+"\n")
+    sys.stdout.flush()
+
+def cli_wait(interval):
+    last={}
+    tracked={}
+    while True:
+        progress_event.wait(interval)
+        progress_event.clear()
+        with active_tasks_lock:
+            tracked.update((tid,t) for tid,t in live_tasks.items() if t["type"] in("file_upload","download"))
+            snap={tid:(t["progress"],t["total"],t.get("bytes",0),t["status"]) for tid,t in tracked.items()}
+            idle= all(task_idle(tid,t) for tid,t in tracked.items())
+        for tid,v in snap.items():
+            if last.get(tid)==v:continue
+            last[tid]= v
+            t= tracked[tid]
+            emit({"task":tid,"type":t["type"],"file":t.get("file_id"),"progress":v[0],"total":v[1],"bytes":v[2],"bytes_total":t.get("bytes_total",0),"status":v[3]})
+        if idle:break
+    ok= True
+    for tid,t in tracked.items():
+        if t["type"]=="download":ok&= t["status"].startswith("Download complete")
+        else:ok&= t["progress"]>=t["total"]
+    tasks_queue.join()
+    return ok
+
+def cli_ls(cfg,args):
+    start= "/".join(dir_path_list(args.path))
+    node= dir_index.get(start)
+    if node is None:
+        fid= resolve_file(args.path)
+        if not fid:
+            print(f"drivecord: {args.path}: not found",file=sys.stderr)
+            return 1
+        d,f= find_file(cfg,fid)
+        emit_file(dir_path_of(cfg,d),f,args.json)
+        return 0
+    def dfs(d,path):
+        for f in d["files"]:emit_file(path,f,args.json)
+        for sb in d["subdirs"]:
+            if args.recursive:dfs(sb,path+"/"+sb["name"])
+            elif args.json:emit({"dir":path+"/"+sb["name"]})
+            else:print(f"{path}/{sb['name']}/")
+    dfs(node,start)
+    return 0
+
+def cli_config(cfg,args):
+    if args.key=="directories":
+        print("drivecord: directories: not a setting",file=sys.stderr)
+        return 1
+    if not args.key:
+        for k in sorted(cfg):
+            if k!="directories":print(f"{k} = {json.dumps(cfg[k])}")
+        return 0
+    if args.unset:
+        with db_lock,db_conn:
+            db_conn.execute("DELETE FROM settings WHERE key=?",(args.key,))
+        return 0
+    if args.value is None:
+        if args.key not in cfg:
+            print(f"drivecord: {args.key}: not set, using the default",file=sys.stderr)
+            return 1
+        print(json.dumps(cfg[args.key]))
+        return 0
+    v= args.value
+    if not isinstance(cfg.get(args.key),str):
+        try:v= json.loads(v)
+        except ValueError:pass
+    cfg[args.key]= v
+    save_config(cfg,(args.key,))
+    return 0
+
+def emit_file(path,f,js):
+    if js:emit({"file_id":f["file_id"],"path":f"{path}/{f['file_name']}","size":f.get("size"),"upload_date":f.get("upload_date"),"in_process":f.get("in_process",False)})
+    else:print(f"{f['file_id']:8}\t{f.get('size',0):>12}\t{f.get('upload_date',''):19}\t{path}/{f['file_name']}{' (uploading)' if f.get('in_process') else ''}")
+
+def cli_main(argv):
+    ap= argparse.ArgumentParser(prog="drivecord",description="Non-interactive DriveCord commands. Run without arguments for the TUI.")
+    ap.add_argument("-j","--jobs",type=int,default=0,help="worker threads (default: one per token, max 10)")
+    ap.add_argument("--interval",type=float,default=0.5,help="seconds between progress lines")
+    ap.add_argument("--engine",choices=("threads","async"),help="transfer engine (default: the engine config key)")
+    sub= ap.add_subparsers(dest="cmd",required=True)
+    p= sub.add_parser("put",help="upload files or directories")
+    p.add_argument("paths",nargs="+")
+    p.add_argument("-d","--dir",default="root",help="destination directory in the tree")
+    p= sub.add_parser("get",help="download files by ID or tree path")
+    p.add_argument("files",nargs="+")
+    p.add_argument("-o","--out",default="Drivecord Downloads",help="output folder")
+    p= sub.add_parser("ls",help="list the tree")
+    p.add_argument("path",nargs="?",default="root")
+    p.add_argument("-r","--recursive",action="store_true")
+    p.add_argument("--json",action="store_true",help="one JSON object per line")
+    p= sub.add_parser("rm",help="delete files, or directories with -r")
+    p.add_argument("files",nargs="+")
+    p.add_argument("-r","--recursive",action="store_true")
+    p= sub.add_parser("mv",help="move files to a directory")
+    p.add_argument("files",nargs="+")
+    p.add_argument("dest")
+    p= sub.add_parser("config",help="show or change settings")
+    p.add_argument("key",nargs="?",help="setting to show or change; omit to list all")
+    p.add_argument("value",nargs="?",help="new value, as JSON unless the setting is a string")
+    p.add_argument("--unset",action="store_true",help="restore the setting's default")
+    args= ap.parse_args(argv)
+    cfg= load_config()
+    if args.engine:cfg["engine"]= args.engine
+    apply_chunk_size(cfg)
+    apply_http_settings(cfg)
+    if args.cmd=="ls":return cli_ls(cfg,args)
+    if args.cmd=="config":return cli_config(cfg,args)
+    rc=0
+    if args.cmd in("rm","mv"):
+        start_workers(cfg,1)
+        for a in args.files:
+            fid= resolve_file(a)
+            path="/".join(dir_path_list(a))
+            if fid and args.cmd=="rm":remove_file_record(cfg,fid)
+            elif fid:move_file_record(cfg,fid,dir_path_list(args.dest))
+            elif args.cmd=="rm" and args.recursive and path in dir_index and path!="root":delete_dir(cfg,path)
+            else:
+                print(f"drivecord: {a}: not found",file=sys.stderr)
+                rc=1
+        tasks_queue.join()
+        stop_workers()
+        return rc
+    ok,e= valid_ids(cfg["server_id"],cfg["channel_id"])
+    if not ok or not cfg["bot_tokens"]:
+        print(f"drivecord: {e or 'No bot tokens configured'}",file=sys.stderr)
+        return 2
+    start_workers(cfg,args.jobs)
+    start_metrics(cfg)
+    if args.cmd=="put":
+        sp= dir_path_list(args.dir)
+        for fp in args.paths:
+            if os.path.isdir(fp):queue_upload_dir(cfg,fp,sp)
+            elif os.path.isfile(fp):queue_upload(cfg,fp,sp)
+            else:
+                print(f"drivecord: {fp}: no such file",file=sys.stderr)
+                rc=1
+    else:
+        for a in args.files:
+            fid= resolve_file(a)
+            if fid:queue_download(cfg,fid,args.out)
+            else:
+                print(f"drivecord: {a}: not found",file=sys.stderr)
+                rc=1
+    if not cli_wait(args.interval):rc=1
+    stop_workers()
+    return rc
 
 if __name__=="__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv)>1:sys.exit(cli_main(sys.argv[1:]))
     curses.wrapper(main)
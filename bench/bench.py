@@ -0,0 +1,122 @@
+import argparse, itertools, json, os, subprocess, sys, tempfile, threading, time, hashlib
+
+HERE= os.path.dirname(os.path.abspath(__file__))
+ROOT= os.path.dirname(HERE)
+
+def peak_rss_mb():
+    try:import resource
+    except ImportError:return None
+    r= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(r/1048576 if sys.platform=="darwin" else r/1024,1)
+
+def pct(xs,p):
+    if not xs:return None
+    xs= sorted(xs)
+    return round(xs[min(len(xs)-1,int(p/100*len(xs)))]*1000,1)
+
+def write_random(path,size):
+    with open(path,"wb")as f:
+        left= size
+        while left>0:
+            n= min(left,1048576)
+            f.write(os.urandom(n))
+            left-= n
+
+def sha256_file(path):
+    h= hashlib.sha256()
+    with open(path,"rb")as f:
+        for blk in iter(lambda:f.read(1048576),b""):h.update(blk)
+    return h.hexdigest()
+
+def atimed(fn,out):
+    async def wrap(*a,**k):
+        t0= time.perf_counter()
+        try:return await fn(*a,**k)
+        finally:out.append(time.perf_counter()-t0)
+    return wrap
+
+def run_case(size_mb,chunk_mb,tokens,jobs,engine):
+    sys.path.insert(0,ROOT)
+    import DriveCord as D
+    D.emit= lambda obj:None
+    ups,dls=[],[]
+    D.aup_chunk= atimed(D.aup_chunk,ups)
+    D.afetch_chunk= atimed(D.afetch_chunk,dls)
+    cfg= D.load_config()
+    cfg.update(server_id="1",channel_id="1",bot_tokens=[f"bench{i}" for i in range(tokens)],chunk_size_mb=chunk_mb,dedup=False,manifest=False,engine=engine)
+    D.apply_chunk_size(cfg)
+    D.apply_http_settings(cfg)
+    src="source.bin"
+    write_random(src,int(size_mb*1048576))
+    D.start_workers(cfg,jobs)
+    t0= time.perf_counter()
+    D.queue_upload(cfg,src,["root"])
+    ok_up= D.cli_wait(0.05)
+    t_up= time.perf_counter()-t0
+    fid= cfg["directories"]["files"][0]["file_id"]
+    t0= time.perf_counter()
+    D.queue_download(cfg,fid,"out")
+    ok_dl= D.cli_wait(0.05)
+    t_dl= time.perf_counter()-t0
+    D.stop_workers()
+    same= ok_dl and sha256_file(src)==sha256_file(os.path.join("out",src))
+    return {
+        "size_mb":size_mb,"chunk_mb":chunk_mb,"tokens":tokens,"engine":engine,
+        "ok":bool(ok_up and same),
+        "upload_mb_s":round(size_mb/t_up,2),"download_mb_s":round(size_mb/t_dl,2),
+        "upload_p50_ms":pct(ups,50),"upload_p99_ms":pct(ups,99),
+        "download_p50_ms":pct(dls,50),"download_p99_ms":pct(dls,99),
+        "messages":len(ups),"chunk_fetches":len(dls),
+        "peak_rss_mb":peak_rss_mb()
+    }
+
+def start_mock(a):
+    cmd=[sys.executable,os.path.join(HERE,"mock_discord.py"),"--port","0","--latency",str(a.latency),"--jitter",str(a.jitter),"--bandwidth",str(a.bandwidth),"--p429",str(a.p429),"--bucket",str(a.bucket)]
+    pr= subprocess.Popen(cmd,stdout=subprocess.PIPE,text=True)
+    return pr,pr.stdout.readline().strip()
+
+def floats(s):
+    return[float(x) if "." in x else int(x) for x in s.split(",")]
+
+def main():
+    ap= argparse.ArgumentParser(description="Upload/download throughput benchmark against the local Discord mock.")
+    ap.add_argument("--sizes",default="16,64",help="file sizes in MB")
+    ap.add_argument("--chunk-sizes",default="5,10",help="chunk sizes in MB (5-25)")
+    ap.add_argument("--tokens",default="1,4",help="bot token counts")
+    ap.add_argument("--jobs",type=int,default=0,help="worker threads, 0 = DriveCord default")
+    ap.add_argument("--engine",default="threads",help="comma-separated transfer engines: threads, async")
+    ap.add_argument("--api",default="",help="use an already running API base instead of starting the mock")
+    ap.add_argument("--latency",type=float,default=0.02)
+    ap.add_argument("--jitter",type=float,default=0.01)
+    ap.add_argument("--bandwidth",type=float,default=0.0,help="MB/s per connection, 0 = unlimited")
+    ap.add_argument("--p429",type=float,default=0.0)
+    ap.add_argument("--bucket",type=int,default=0)
+    ap.add_argument("--json",default="",help="also write results to this file")
+    ap.add_argument("--case",nargs=3,type=float,metavar=("SIZE_MB","CHUNK_MB","TOKENS"),help=argparse.SUPPRESS)
+    a= ap.parse_args()
+    if a.case:
+        os.chdir(tempfile.mkdtemp(prefix="drivecord-bench-"))
+        print(json.dumps(run_case(a.case[0],int(a.case[1]),int(a.case[2]),a.jobs,a.engine)),flush=True)
+        return
+    pr=None
+    api= a.api
+    if not api:pr,api= start_mock(a)
+    env= dict(os.environ,DRIVECORD_API_BASE=api)
+    rows=[]
+    try:
+        for eng,sz,cs,tk in itertools.product(a.engine.split(","),floats(a.sizes),floats(a.chunk_sizes),floats(a.tokens)):
+            out= subprocess.run([sys.executable,os.path.abspath(__file__),"--case",str(sz),str(cs),str(tk),"--jobs",str(a.jobs),"--engine",eng],env=env,capture_output=True,text=True)
+            lines= out.stdout.strip().splitlines()
+            if out.returncode or not lines:
+                print(f"case {eng} {sz}MB/{cs}MB/{tk} tokens failed:\n{out.stderr}",file=sys.stderr)
+                continue
+            row= json.loads(lines[-1])
+            rows.append(row)
+            print(f"{row['engine']:<7} {row['size_mb']:>7}MB chunk {row['chunk_mb']:>2}MB tokens {row['tokens']:>2} | up {row['upload_mb_s']:>7} MB/s p50 {row['upload_p50_ms']} p99 {row['upload_p99_ms']} ms | down {row['download_mb_s']:>7} MB/s p50 {row['download_p50_ms']} p99 {row['download_p99_ms']} ms | rss {row['peak_rss_mb']} MB{'' if row['ok'] else ' | FAILED'}",flush=True)
+    finally:
+        if pr:pr.terminate()
+    if a.json:
+        with open(a.json,"w")as f:json.dump(rows,f,indent=2)
+
+if __name__=="__main__":
+    main()
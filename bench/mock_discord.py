@@ -0,0 +1,201 @@
+import argparse, itertools, json, random, re, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+DISCORD_EPOCH_MS=1420070400000
+SEND_SLICE=65536
+
+class MockDiscord(ThreadingHTTPServer):
+    daemon_threads=True
+    request_queue_size=1024
+    def __init__(self,addr,latency=0.0,jitter=0.0,bandwidth=0.0,p429=0.0,bucket=0,bucket_reset=1.0):
+        super().__init__(addr,Handler)
+        self.latency= latency
+        self.jitter= jitter
+        self.bandwidth= bandwidth
+        self.p429= p429
+        self.bucket= bucket
+        self.bucket_reset= bucket_reset
+        self.lock= threading.Lock()
+        self.messages={}
+        self.blobs={}
+        self.pins=set()
+        self.buckets={}
+        self.seq= itertools.count()
+        self.stats={"requests":0,"posts":0,"cdn":0,"rate_limited":0,"bytes_in":0,"bytes_out":0}
+        self.base=f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def new_id(self):
+        ms= int(time.time()*1000)-DISCORD_EPOCH_MS
+        return str((ms<<22)|(next(self.seq)&0x3fffff))
+
+    def limit(self,token,route):
+        if self.p429 and random.random()<self.p429:return round(random.uniform(0.05,0.5),3),0,1.0
+        if not self.bucket:return None,None,None
+        now= time.time()
+        with self.lock:
+            b= self.buckets.get((token,route))
+            if not b or b[1]<=now:b= self.buckets[(token,route)]=[self.bucket,now+self.bucket_reset]
+            if b[0]<=0:return round(b[1]-now,3),0,b[1]-now
+            b[0]-=1
+            return None,b[0],b[1]-now
+
+def multipart_parts(ctype,body):
+    m= re.search(r'boundary="?([^";]+)"?',ctype)
+    if not m:return
+    sep= b"--"+m.group(1).encode()
+    for part in body.split(sep)[1:]:
+        if part.startswith(b"--"):break
+        head,_,dd= part.partition(b"\r\n\r\n")
+        head= head.decode("utf-8","replace")
+        name= re.search(r'name="([^"]*)"',head)
+        fn= re.search(r'filename="([^"]*)"',head)
+        yield(name.group(1) if name else"",fn.group(1) if fn else None,dd[:-2] if dd.endswith(b"\r\n") else dd)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version="HTTP/1.1"
+
+    def log_message(self,*a):pass
+
+    def do_GET(self):self.handle_any("GET")
+    def do_POST(self):self.handle_any("POST")
+    def do_PUT(self):self.handle_any("PUT")
+    def do_DELETE(self):self.handle_any("DELETE")
+
+    def read_body(self):
+        n= int(self.headers.get("Content-Length",0))
+        out=[]
+        t0= time.time()
+        got=0
+        while got<n:
+            dd= self.rfile.read(min(SEND_SLICE,n-got))
+            if not dd:break
+            out.append(dd)
+            got+= len(dd)
+            self.throttle(t0,got)
+        self.server.stats["bytes_in"]+= got
+        return b"".join(out)
+
+    def throttle(self,t0,done):
+        bw= self.server.bandwidth
+        if bw>0:
+            ahead= done/bw-(time.time()-t0)
+            if ahead>0:time.sleep(ahead)
+
+    def send(self,code,body=b"",ctype="application/json",headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type",ctype)
+        self.send_header("Content-Length",str(len(body)))
+        for k,v in(headers or{}).items():self.send_header(k,v)
+        self.end_headers()
+        t0= time.time()
+        for i in range(0,len(body),SEND_SLICE):
+            self.wfile.write(body[i:i+SEND_SLICE])
+            self.throttle(t0,i+SEND_SLICE)
+        self.server.stats["bytes_out"]+= len(body)
+
+    def send_json(self,code,obj,headers=None):
+        self.send(code,json.dumps(obj).encode(),headers=headers)
+
+    def handle_any(self,method):
+        srv= self.server
+        srv.stats["requests"]+=1
+        if srv.latency or srv.jitter:time.sleep(srv.latency+random.uniform(0,srv.jitter))
+        u= urlsplit(self.path)
+        q={k:v[0] for k,v in parse_qs(u.query).items()}
+        body= self.read_body()
+        m= re.match(r"/cdn/(\d+)/(\d+)/",u.path)
+        if m:return self.cdn(method,m.group(1),int(m.group(2)))
+        path= re.sub(r"^/api/v\d+","",u.path)
+        route= method+" "+re.sub(r"/\d+$","/:id",path)
+        retry,remaining,reset= srv.limit(self.headers.get("Authorization",""),route)
+        hd={}
+        if remaining is not None:hd={"X-RateLimit-Remaining":str(remaining),"X-RateLimit-Reset-After":f"{reset:.3f}"}
+        if retry is not None:
+            srv.stats["rate_limited"]+=1
+            return self.send_json(429,{"message":"You are being rate limited.","retry_after":retry,"global":False},{"Retry-After":str(retry),**hd})
+        if path=="/users/@me" and method=="GET":
+            return self.send_json(200,{"id":"1","username":"drivecord-mock","bot":True},hd)
+        m= re.fullmatch(r"/channels/(\d+)/messages",path)
+        if m and method=="POST":return self.post_message(m.group(1),body,hd)
+        if m and method=="GET":return self.list_messages(m.group(1),q,hd)
+        m= re.fullmatch(r"/channels/(\d+)/messages/(\d+)",path)
+        if m:
+            msg= srv.messages.get(m.group(2))
+            if not msg or msg["channel_id"]!=m.group(1):return self.send_json(404,{"message":"Unknown Message","code":10008},hd)
+            if method=="DELETE":
+                with srv.lock:srv.messages.pop(m.group(2),None)
+                return self.send(204,headers=hd)
+            return self.send_json(200,msg,hd)
+        m= re.fullmatch(r"/channels/(\d+)/pins(?:/(\d+))?",path)
+        if m:
+            if method=="GET":return self.send_json(200,[srv.messages[x] for x in sorted(srv.pins,key=int,reverse=True) if x in srv.messages],hd)
+            with srv.lock:
+                if method=="PUT":srv.pins.add(m.group(2))
+                else:srv.pins.discard(m.group(2))
+            return self.send(204,headers=hd)
+        self.send_json(404,{"message":"404: Not Found","code":0},hd)
+
+    def post_message(self,channel,body,hd):
+        srv= self.server
+        mid= srv.new_id()
+        content=""
+        atts=[]
+        for name,fn,dd in multipart_parts(self.headers.get("Content-Type",""),body):
+            if name=="content":content= dd.decode()
+            elif name.startswith("files["):
+                fn= fn or name
+                aid= srv.new_id()
+                i= len(atts)
+                atts.append({"id":aid,"filename":fn,"size":len(dd),"url":f"{srv.base}/cdn/{mid}/{i}/{fn}"})
+                srv.blobs[(mid,i)]= dd
+        obj={"id":mid,"channel_id":channel,"content":content,"attachments":atts}
+        with srv.lock:
+            srv.messages[mid]= obj
+            srv.stats["posts"]+=1
+        self.send_json(200,obj,hd)
+
+    def list_messages(self,channel,q,hd):
+        srv= self.server
+        lim= max(1,min(100,int(q.get("limit",50))))
+        ids= sorted((int(k) for k,v in list(srv.messages.items()) if v["channel_id"]==channel),reverse=True)
+        if "before" in q:ids=[x for x in ids if x<int(q["before"])]
+        if "after" in q:ids=[x for x in ids if x>int(q["after"])][-lim:]
+        self.send_json(200,[srv.messages[str(x)] for x in ids[:lim]],hd)
+
+    def cdn(self,method,mid,i):
+        srv= self.server
+        srv.stats["cdn"]+=1
+        dd= srv.blobs.get((mid,i)) if mid in srv.messages else None
+        if dd is None or method!="GET":return self.send(404,b"",ctype="text/plain")
+        rg= re.fullmatch(r"bytes=(\d+)-(\d*)",self.headers.get("Range",""))
+        if rg:
+            a= int(rg.group(1))
+            z= int(rg.group(2)) if rg.group(2) else len(dd)-1
+            return self.send(206,dd[a:z+1],"application/octet-stream",{"Content-Range":f"bytes {a}-{min(z,len(dd)-1)}/{len(dd)}"})
+        self.send(200,dd,"application/octet-stream")
+
+def start(host="127.0.0.1",port=0,**opts):
+    srv= MockDiscord((host,port),**opts)
+    th= threading.Thread(target=srv.serve_forever,daemon=True)
+    th.start()
+    return srv
+
+def main():
+    ap= argparse.ArgumentParser(description="Local stand-in for the Discord endpoints DriveCord uses.")
+    ap.add_argument("--host",default="127.0.0.1")
+    ap.add_argument("--port",type=int,default=8787,help="0 picks a free port")
+    ap.add_argument("--latency",type=float,default=0.0,help="added seconds per request")
+    ap.add_argument("--jitter",type=float,default=0.0,help="extra random seconds per request, 0..jitter")
+    ap.add_argument("--bandwidth",type=float,default=0.0,help="MB/s per connection, 0 = unlimited")
+    ap.add_argument("--p429",type=float,default=0.0,help="probability of an injected 429 per API request")
+    ap.add_argument("--bucket",type=int,default=0,help="requests per token and route per --bucket-reset seconds, 0 = unlimited")
+    ap.add_argument("--bucket-reset",type=float,default=1.0)
+    a= ap.parse_args()
+    srv= MockDiscord((a.host,a.port),latency=a.latency,jitter=a.jitter,bandwidth=a.bandwidth*1048576,p429=a.p429,bucket=a.bucket,bucket_reset=a.bucket_reset)
+    print(f"{srv.base}/api/v9",flush=True)
+    try:srv.serve_forever()
+    except KeyboardInterrupt:pass
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,77 @@
+import itertools, os, random, sys, tempfile, unittest
+
+ROOT= os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.join(ROOT,"bench"))
+import DriveCord as D
+
+def encode(k,m,chunks):
+    par=[]
+    for s0 in range(0,len(chunks),k):
+        ln= max(len(c) for c in chunks[s0:s0+k])
+        acc=[0]*m
+        for i,c in enumerate(chunks[s0:s0+k]):D.rs_add(acc,k,i,c.ljust(ln,b"\0"))
+        par+=[a.to_bytes(ln,"little") for a in acc]
+    return par
+
+class ParityRoundTrip(unittest.TestCase):
+    def test_decode_after_losing_up_to_m_pieces(self):
+        rnd= random.Random(1)
+        for k,m,cc in((3,2,7),(8,2,11),(4,3,4),(5,1,1)):
+            chunks=[rnd.randbytes(64) for _ in range(cc-1)]+[rnd.randbytes(37)]
+            par= encode(k,m,chunks)
+            for sn,s0 in enumerate(range(0,cc,k)):
+                kk= min(k,cc-s0)
+                ln= max(len(c) for c in chunks[s0:s0+kk])
+                pieces={i:chunks[s0+i].ljust(ln,b"\0") for i in range(kk)}
+                pieces.update({kk+j:par[sn*m+j] for j in range(m)})
+                for lost in itertools.combinations(range(kk+m),m):
+                    have={li:v for li,v in pieces.items() if li not in lost}
+                    want=[i for i in lost if i<kk]
+                    out= D.rs_decode(k,kk,have,want,ln)
+                    for i in want:
+                        self.assertEqual(out[i][:len(chunks[s0+i])],chunks[s0+i],(k,m,cc,sn,lost))
+
+class ParityUpload(unittest.TestCase):
+    def setUp(self):
+        import mock_discord
+        self.cwd= os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="drivecord-test-"))
+        self.srv= mock_discord.start()
+        self.api= D.API_BASE
+        D.API_BASE= self.srv.base+"/api/v9"
+        D.STOP_WORKERS= False
+        D.worker_threads.clear()
+
+    def tearDown(self):
+        D.stop_workers()
+        D.STOP_WORKERS= False
+        D.worker_threads.clear()
+        D.API_BASE= self.api
+        self.srv.shutdown()
+        with D.db_lock:
+            D.db_conn.close()
+            D.db_conn= None
+        D.file_index.clear()
+        D.dir_index.clear()
+        os.chdir(self.cwd)
+
+    def test_download_survives_a_deleted_message(self):
+        cfg= D.load_config()
+        cfg.update(server_id="1",channel_id="1",bot_tokens=["t"],chunk_size_mb=5,parity_data=3,parity_shards=2,manifest=False)
+        D.apply_chunk_size(cfg)
+        data= os.urandom(5*1024*1024*4+1234)
+        with open("src.bin","wb")as f:f.write(data)
+        D.start_workers(cfg)
+        D.queue_upload(cfg,"src.bin",["root"])
+        self.assertTrue(D.cli_wait(0.05))
+        f= cfg["directories"]["files"][0]
+        pieces= f["chunks"]+f["parity_chunks"]
+        self.assertEqual(len({e["message_id"] for e in pieces}),len(pieces))
+        with self.srv.lock:self.srv.messages.pop(f["chunks"][0]["message_id"])
+        D.queue_download(cfg,f["file_id"],"out")
+        self.assertTrue(D.cli_wait(0.05))
+        with open(os.path.join("out","src.bin"),"rb")as g:self.assertEqual(g.read(),data)
+
+if __name__=="__main__":
+    unittest.main()